@@ -0,0 +1,99 @@
+"""
+Background loading of the next page's images.
+
+attach_prefetch(app_name, page_sequence) builds a manifest of the images
+each page shows, from its template, the templates it includes and the
+labels of its form fields, and gives every page a prefetch_next_page
+attribute holding the images of the page after it in page_sequence.
+global/Page.html puts that markup in a <template>; once the current page
+has loaded, a script makes live copies of it without adding them to the
+page, so the browser fetches the next page's images while the participant
+reads this one.
+
+Images are found as {{ C.IMAGES.<name> }} (see static_images.picture),
+<picture> and <img> tags, and {{ static '...' }} paths. A <link
+rel=prefetch> names a single URL, whereas loading the page's own <picture>
+markup lets the browser choose the same format and width it will request
+on the next page. The manifest is built once per process, when the app is
+imported; manifest(app_name) returns it.
+"""
+import re
+import sys
+from pathlib import Path
+
+from markupsafe import Markup
+from otree.api import Page
+
+IMAGE_SUFFIXES = ('.png', '.jpg', '.jpeg', '.gif', '.svg', '.webp', '.avif')
+
+INCLUDE = re.compile(r'{%\s*(include|include_sibling)\s+["\']([^"\']+)["\']\s*%}')
+CONSTANT_IMAGE = re.compile(r'{{\s*C\.IMAGES\.(\w+)\s*}}')
+STATIC_PATH = re.compile(r'{[{%]\s*static\s+["\']([^"\']+)["\']\s*[}%]}')
+PICTURE = re.compile(r'<picture>.*?</picture>', re.S)
+IMG = re.compile(r'<img\b[^>]*>')
+
+# 页面不在 attach_prefetch 处理过的 page_sequence 中时，global/Page.html 什么也不输出
+Page.prefetch_next_page = ''
+
+_manifests = {}
+
+
+def _template_text(path, seen):
+    """The template at `path` with the templates it includes, each read once."""
+    if path in seen or not path.is_file():
+        return ''
+    seen.add(path)
+    text = path.read_text(encoding='utf-8')
+    for tag, name in INCLUDE.findall(text):
+        # include_sibling 相对于当前模板；include 的路径以应用目录开头
+        included = path.parent / name if tag == 'include_sibling' else path.parents[1] / name
+        text += _template_text(included, seen)
+    return text
+
+
+def _field_labels(page, player_model):
+    labels = []
+    form_model = getattr(page, 'form_model', None)
+    if form_model != 'player':
+        return labels
+    for name in getattr(page, 'form_fields', []):
+        column = player_model.__table__.columns.get(name)
+        label = column is not None and getattr(column, 'form_props', {}).get('label')
+        if label:
+            labels.append(str(label))
+    return labels
+
+
+def page_images(app_dir, page, constants, player_model):
+    """The markup of each distinct image the page shows, in order of appearance."""
+    text = _template_text(app_dir / f'{page.__name__}.html', set())
+    text = CONSTANT_IMAGE.sub(lambda m: str(getattr(constants, 'IMAGES', {}).get(m.group(1), '')), text)
+    text = STATIC_PATH.sub(
+        lambda m: f'<img src="/static/{m.group(1)}">' if m.group(1).lower().endswith(IMAGE_SUFFIXES) else '',
+        text,
+    )
+    text += ''.join(_field_labels(page, player_model))
+
+    images = []
+    # <picture> 里的 <img> 只作后备，不单独计入
+    for image in PICTURE.findall(text) + IMG.findall(PICTURE.sub('', text)):
+        if image not in images:
+            images.append(image)
+    return images
+
+
+def attach_prefetch(app_name, page_sequence):
+    module = sys.modules[app_name]
+    app_dir = Path(module.__file__).parent
+    manifest = {
+        page.__name__: page_images(app_dir, page, module.C, module.Player)
+        for page in page_sequence
+    }
+    _manifests[app_name] = manifest
+    for page, next_page in zip(page_sequence, page_sequence[1:]):
+        page.prefetch_next_page = Markup(''.join(manifest[next_page.__name__]))
+
+
+def manifest(app_name):
+    """{page name: [image markup, ...]} for an app passed to attach_prefetch."""
+    return _manifests.get(app_name, {})
@@ -0,0 +1,191 @@
+"""
+Bot benchmark for the full pre -> main -> end flow.
+
+    python benchmark.py                      # 30, 300 and 3000 participants
+    python benchmark.py --sizes 30 300
+    python benchmark.py --update-baselines   # store the results as the new baselines
+
+For each size a session of your_experiment is created, and every participant
+is played through by the PlayerBots in */tests.py (case 'pass_first').
+The run uses the same in-process server and in-memory database as `otree test`.
+It reports:
+
+- session creation time (creating_session of every app)
+- per-page latency: p50/p95 of each bot submit, i.e. the page's POST handlers
+  plus rendering the next page
+- DB writes (INSERT/UPDATE/DELETE rows) per participant while the bots play
+
+It exits with status 1 if a figure is worse than its baseline in
+benchmark_baselines.json by more than the tolerance.
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+from collections import defaultdict
+from pathlib import Path
+
+PROJECT_DIR = Path(__file__).resolve().parent
+BASELINES_PATH = PROJECT_DIR / 'benchmark_baselines.json'
+SESSION_CONFIG = 'your_experiment'
+BENCHMARK_CASE = 'pass_first'
+DEFAULT_SIZES = [30, 300, 3000]
+
+# 允许相对基线变差的比例；计时受机器负载影响，容差较宽，写库次数应基本固定
+TOLERANCE = {
+    'creation_seconds': 0.5,
+    'p95_ms': 0.5,
+    'db_writes_per_participant': 0.05,
+}
+# 很小的数值上比例没有意义，另加绝对余量
+SLACK = {
+    'creation_seconds': 0.5,
+    'p95_ms': 5.0,
+    'db_writes_per_participant': 0.5,
+}
+
+
+def setup_otree():
+    os.chdir(PROJECT_DIR)
+    sys.path.insert(0, str(PROJECT_DIR))
+    # same database setup as `otree test`
+    os.environ['OTREE_IN_MEMORY'] = '1'
+    os.environ.setdefault('EXPERIMENT_LOG_LEVEL', 'WARNING')
+
+    from otree.main import setup
+
+    setup()
+    # otherwise every bot submit is logged
+    logging.getLogger('otree').setLevel(logging.WARNING)
+
+
+class WriteCounter:
+    """Counts rows written through the SQLAlchemy engine."""
+
+    def __init__(self, engine):
+        from sqlalchemy import event
+
+        self.count = 0
+        event.listen(engine, 'before_cursor_execute', self.on_execute)
+
+    def on_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip()[:6].upper() in ('INSERT', 'UPDATE', 'DELETE'):
+            self.count += len(parameters) if executemany else 1
+
+
+def time_submits(bot, latencies):
+    submit = bot.submit
+
+    def timed_submit(submission):
+        start = time.perf_counter()
+        submit(submission)
+        latencies[submission.page_class.__name__].append((time.perf_counter() - start) * 1000)
+
+    bot.submit = timed_submit
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def run(size, writes):
+    from otree.bots.runner import SessionBotRunner, make_bots
+    from otree.database import db
+    from otree.session import create_session
+    from pre.tests import CASES
+
+    start = time.perf_counter()
+    session = create_session(
+        SESSION_CONFIG,
+        num_participants=size,
+        # 3000 人超过经理池大小，允许重复使用经理
+        modified_session_config_fields=dict(manager_replacement=True),
+    )
+    db.commit()
+    creation_seconds = time.perf_counter() - start
+
+    bots = make_bots(session_pk=session.id, case_number=CASES.index(BENCHMARK_CASE), use_browser_bots=False)
+    latencies = defaultdict(list)
+    for bot in bots:
+        time_submits(bot, latencies)
+
+    writes.count = 0
+    SessionBotRunner(bots=bots).play()
+
+    return {
+        'creation_seconds': round(creation_seconds, 3),
+        'db_writes_per_participant': round(writes.count / size, 2),
+        'pages': {
+            page: {'p50_ms': round(percentile(ms, 0.5), 2), 'p95_ms': round(percentile(ms, 0.95), 2)}
+            for page, ms in latencies.items()
+        },
+    }
+
+
+def regressions(size, result, baseline):
+    """Figures in result that exceed the baseline by more than the tolerance."""
+    found = []
+
+    def check(label, metric, value, base):
+        limit = base * (1 + TOLERANCE[metric]) + SLACK[metric]
+        if value > limit:
+            found.append(f"{size} participants, {label}: {value} (baseline {base}, limit {limit:.2f})")
+
+    for metric in ['creation_seconds', 'db_writes_per_participant']:
+        if metric in baseline:
+            check(metric, metric, result[metric], baseline[metric])
+    for page, figures in result['pages'].items():
+        base = baseline.get('pages', {}).get(page)
+        if base:
+            check(f"{page} p95_ms", 'p95_ms', figures['p95_ms'], base['p95_ms'])
+    return found
+
+
+def print_result(size, result):
+    print(f"\n{size} participants")
+    print(f"  session creation: {result['creation_seconds']:.3f} s")
+    print(f"  DB writes per participant: {result['db_writes_per_participant']}")
+    print(f"  {'page':<20} {'p50 ms':>8} {'p95 ms':>8}")
+    for page, figures in result['pages'].items():
+        print(f"  {page:<20} {figures['p50_ms']:>8.2f} {figures['p95_ms']:>8.2f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the experiment with bots")
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES, help="session sizes to run")
+    parser.add_argument('--update-baselines', action='store_true', help="store the results as baselines")
+    args = parser.parse_args(argv)
+
+    setup_otree()
+    from otree.database import engine
+
+    baselines = json.loads(BASELINES_PATH.read_text()) if BASELINES_PATH.exists() else {}
+    writes = WriteCounter(engine)
+    failures = []
+
+    for size in args.sizes:
+        result = run(size, writes)
+        print_result(size, result)
+        if args.update_baselines:
+            baselines[str(size)] = result
+        elif str(size) in baselines:
+            failures += regressions(size, result, baselines[str(size)])
+        else:
+            print(f"  (no baseline for {size} participants)")
+
+    if args.update_baselines:
+        BASELINES_PATH.write_text(json.dumps(baselines, indent=2) + '\n')
+        print(f"\nBaselines written to {BASELINES_PATH.name}")
+    elif failures:
+        print("\nRegressions:")
+        for failure in failures:
+            print(f"  {failure}")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,54 @@
+"""
+Per-session counters kept in the database.
+
+Each app declares its own Counter extra model with the fields
+
+    subsession = models.Link(Subsession)
+    name = models.StringField()
+    value = models.IntegerField(initial=0)
+
+(oTree ties an extra model to the app that defines it), indexes it with
+index_counters(Counter), creates its counters in creating_session, and
+passes the model to the functions here.
+Pages are served by a single process (prodserver1of2, see page_timing.py),
+but it handles requests concurrently, so a counter is changed with a single
+SQL UPDATE: concurrent submits don't lose updates or rewrite session.vars.
+"""
+from otree.database import db
+from sqlalchemy import Index, event
+
+
+def index_counters(model):
+    """Declare the unique (subsession_id, name) index every counter lookup uses."""
+
+    # subsession_id 列由 Link 在映射配置时才生成，索引只能在那之后定义
+    @event.listens_for(model, 'mapper_configured')
+    def _index(mapper, cls):
+        Index(f'{cls.__table__.name}_subsession_name', cls.subsession_id, cls.name, unique=True)
+
+
+def create_counters(model, subsession, names):
+    for name in names:
+        model.create(subsession=subsession, name=name, value=0)
+
+
+def _counter(model, subsession, name):
+    # 不触发 autoflush：否则参与者等对象会在本次请求中被多写一次
+    return db.query(model).autoflush(False).filter_by(subsession_id=subsession.id, name=name)
+
+
+def increment_counter(model, subsession, name, by=1):
+    """Atomically add to a counter."""
+    _counter(model, subsession, name).update({model.value: model.value + by}, synchronize_session=False)
+
+
+def increment_and_get(model, subsession, name, by=1):
+    """Atomically add to a counter and return its new value (one more query than increment_counter)."""
+    query = _counter(model, subsession, name)
+    query.update({model.value: model.value + by}, synchronize_session=False)
+    return query.with_entities(model.value).scalar()
+
+
+def get_counters(model, subsession):
+    """Current counter values as {name: value}, read from the database rather than cached rows."""
+    return dict(db.query(model.name, model.value).filter_by(subsession_id=subsession.id))
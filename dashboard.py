@@ -0,0 +1,121 @@
+"""
+Live progress for the admin report.
+
+track_pages(page_sequence, record) hooks the app's pages so that the app's
+counter function is called with 'submitted:<Page>' when a participant submits
+a page (or skips it because is_displayed returned False), and with
+'arrived:<FirstPage>' the first time they are shown the app's first page. A
+page whose app_after_this_page sends participants to another app also records
+'exited:<Page>' for them. That is at most one counter update per page, and
+page_rows() derives how many participants are on each page from these counts,
+so the admin report reads a handful of counter rows instead of going through
+every player.
+"""
+import functools
+
+# participant.vars key: the apps whose first page the participant was counted as arriving at
+ARRIVED_APPS = 'dashboard_arrived'
+
+
+def arrived(page_name):
+    return f'arrived:{page_name}'
+
+
+def submitted(page_name):
+    return f'submitted:{page_name}'
+
+
+def exited(page_name):
+    return f'exited:{page_name}'
+
+
+def _has(page, hook):
+    return hook in page.__dict__
+
+
+def _exits_app(page):
+    return _has(page, 'app_after_this_page')
+
+
+def page_counter_names(page_sequence):
+    names = [arrived(page_sequence[0].__name__)]
+    for page in page_sequence:
+        names.append(submitted(page.__name__))
+        if _exits_app(page):
+            names.append(exited(page.__name__))
+    return names
+
+
+def _no_vars(player):
+    return {}
+
+
+def _nothing(player, timeout_happened=False):
+    pass
+
+
+def track_pages(page_sequence, record):
+    first = page_sequence[0]
+    app = first.__module__
+    vars_for_template = first.__dict__.get('vars_for_template', staticmethod(_no_vars)).__func__
+
+    # vars_for_template 在每次显示页面时调用（包括刷新和表单错误），只在首次显示时计数
+    @functools.wraps(vars_for_template)
+    def counted_vars_for_template(player):
+        apps = player.participant.vars.get(ARRIVED_APPS, [])
+        if app not in apps:
+            player.participant.vars[ARRIVED_APPS] = apps + [app]
+            record(player, arrived(first.__name__))
+        return vars_for_template(player)
+
+    first.vars_for_template = staticmethod(counted_vars_for_template)
+
+    for page in page_sequence:
+        before_next_page = page.__dict__.get('before_next_page', staticmethod(_nothing)).__func__
+
+        @functools.wraps(before_next_page)
+        def counted_before_next_page(player, timeout_happened=False, _name=page.__name__, _fn=before_next_page):
+            _fn(player, timeout_happened)
+            record(player, submitted(_name))
+
+        page.before_next_page = staticmethod(counted_before_next_page)
+
+        if _has(page, 'is_displayed'):
+            is_displayed = page.__dict__['is_displayed'].__func__
+
+            # 跳过的页面也算作已提交，下一页的人数才对
+            @functools.wraps(is_displayed)
+            def counted_is_displayed(player, _name=page.__name__, _fn=is_displayed):
+                displayed = _fn(player)
+                if not displayed:
+                    record(player, submitted(_name))
+                return displayed
+
+            page.is_displayed = staticmethod(counted_is_displayed)
+
+        if _exits_app(page):
+            app_after_this_page = page.__dict__['app_after_this_page'].__func__
+
+            @functools.wraps(app_after_this_page)
+            def counted_app_after_this_page(player, upcoming_apps, _name=page.__name__, _fn=app_after_this_page):
+                next_app = _fn(player, upcoming_apps)
+                if next_app:
+                    record(player, exited(_name))
+                return next_app
+
+            page.app_after_this_page = staticmethod(counted_app_after_this_page)
+
+
+def page_rows(page_sequence, counts):
+    """Rows of page name, participants on the page now, and participants who submitted it."""
+    rows = []
+    reached = counts.get(arrived(page_sequence[0].__name__), 0)
+    for page in page_sequence:
+        submits = counts.get(submitted(page.__name__), 0)
+        rows.append(dict(page=page.__name__, on_page=reached - submits, submitted=submits))
+        reached = submits - counts.get(exited(page.__name__), 0)
+    return rows
+
+
+def rate(part, whole):
+    return f'{part / whole:.0%}' if whole else '–'
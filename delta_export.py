@@ -0,0 +1,201 @@
+"""
+Incremental export of pre, main, end and end2 for long-running room sessions.
+
+    python delta_export.py --out exports/              # rows changed since the last run
+    python delta_export.py --out exports/ --session CODE
+
+Each run appends to one CSV per app in --out (exports/main.csv, ...), with
+the same participant.* / player.* / session.* columns as oTree's per-app
+export, and records where it stopped in exports/cursor.json. The next run
+only exports participants who changed after the cursor: their last page
+submission (participant._last_page_timestamp) or their settlement
+(python -m main.settle, main player.settled_at) is later. Both columns are
+indexed, so a pull costs time in proportion to the new data rather than to
+everything collected.
+
+A participant who moves on after a pull is exported again with their
+current data, so the files can hold several rows per player: the last one
+is the current one. Each run looks OVERLAP_SECONDS back past the cursor,
+so a submission whose transaction commits after a pull but carries an
+earlier timestamp is not lost; rows that the previous run already wrote
+unchanged are skipped. The cursor is only written after every file has
+been written; if a run fails, the next one repeats its rows.
+
+Changes that come without a page submission, such as live_method answers
+on AttentionCheck or Understanding, are exported when the participant
+next submits a page, or not at all if they leave first. For a complete
+final data set use oTree's own export.
+"""
+import argparse
+import csv
+import hashlib
+import json
+import os
+import sys
+import time
+from pathlib import Path
+
+PROJECT_DIR = Path(__file__).resolve().parent
+CURSOR_FILE = 'cursor.json'
+# 每次查询的参与者数（IN 子句不能太长）
+BATCH_SIZE = 500
+PARTICIPANT_FIELDS = ['_last_page_timestamp']
+# 回看的秒数：时间戳早于游标、但在上次导出之后才提交的事务也能被导出
+OVERLAP_SECONDS = 60
+# 结算（settled_at）也算作参与者的变化
+SETTLEMENT_APP = 'main'
+
+
+def read_cursor(out_dir, session_code):
+    path = out_dir / CURSOR_FILE
+    if not path.exists():
+        return dict(last_page_timestamp=0, session=session_code)
+    cursor = json.loads(path.read_text())
+    # 游标只对同样的导出范围有效
+    if cursor.get('session') != session_code:
+        sys.exit(f"{out_dir} holds an export of {cursor.get('session') or 'all sessions'}; use another directory")
+    return cursor
+
+
+def write_cursor(out_dir, cursor):
+    # 先写临时文件再替换，中断时不会留下半个游标
+    tmp = out_dir / (CURSOR_FILE + '.tmp')
+    tmp.write_text(json.dumps(cursor, indent=2) + '\n')
+    os.replace(tmp, out_dir / CURSOR_FILE)
+
+
+def changed_participants(since, upto, session_code=None):
+    """
+    {participant id: time of the latest change} for the participants who
+    submitted a page, or whose main player was settled, in (since, upto].
+    """
+    from otree.common import get_models_module
+    from otree.database import dbq
+    from otree.models import Participant
+
+    query = dbq(Participant.id, Participant._last_page_timestamp).filter(
+        Participant._last_page_timestamp > since, Participant._last_page_timestamp <= upto
+    )
+    if session_code:
+        query = query.filter(Participant._session_code == session_code)
+    changed = dict(query)
+
+    Player = get_models_module(SETTLEMENT_APP).Player
+    query = dbq(Player.participant_id, Player.settled_at).filter(Player.settled_at > since, Player.settled_at <= upto)
+    if session_code:
+        query = query.join(Participant, Participant.id == Player.participant_id).filter(
+            Participant._session_code == session_code
+        )
+    for participant_id, settled_at in query:
+        changed[participant_id] = max(changed.get(participant_id, 0), settled_at)
+    return changed
+
+
+def app_rows(app_name, participant_ids):
+    """The header, then (participant id, player id, row) for each player of the given participants in the app."""
+    from otree.common import get_models_module
+    from otree.export import get_fields_for_csv, sanitize_for_csv, tweak_player_values_dict
+    from otree.models import Participant, Session
+
+    Player = get_models_module(app_name).Player
+    participant_fields = get_fields_for_csv(Participant) + PARTICIPANT_FIELDS
+    player_fields = get_fields_for_csv(Player)
+    session_fields = ['code']
+    yield (
+        [f'participant.{name}' for name in participant_fields]
+        + [f'player.{name}' for name in player_fields]
+        + [f'session.{name}' for name in session_fields]
+    )
+
+    sessions = {}
+    for start in range(0, len(participant_ids), BATCH_SIZE):
+        batch = participant_ids[start:start + BATCH_SIZE]
+        participants = {row['id']: row for row in Participant.values_dicts(Participant.id.in_(batch))}
+        missing = {row['session_id'] for row in participants.values()} - sessions.keys()
+        if missing:
+            sessions.update((row['id'], row) for row in Session.values_dicts(Session.id.in_(missing)))
+        for player in Player.values_dicts(Player.participant_id.in_(batch), order_by='id'):
+            tweak_player_values_dict(player)
+            participant = participants[player['participant_id']]
+            session = sessions[participant['session_id']]
+            yield participant['id'], player['id'], [
+                sanitize_for_csv(value)
+                for value in [participant[name] for name in participant_fields]
+                + [player[name] for name in player_fields]
+                + [session[name] for name in session_fields]
+            ]
+
+
+def unseen_rows(rows, seen, recent, keep):
+    """
+    The header, then the rows of app_rows() that the previous run didn't
+    already write unchanged (seen: {player id: row digest}). The digests of
+    rows of participants in keep, which the next run looks at again, are
+    recorded in recent.
+    """
+    yield next(rows)
+    for participant_id, player_id, row in rows:
+        digest = hashlib.sha1(repr(row).encode('utf-8')).hexdigest()[:16]
+        if participant_id in keep:
+            recent[str(player_id)] = digest
+        if seen.get(str(player_id)) != digest:
+            yield row
+
+
+def append_rows(path, rows):
+    """Append rows to a CSV file, writing the header only if the file is new. Returns the number of rows."""
+    header = next(rows)
+    if path.exists():
+        with open(path, newline='', encoding='utf-8') as f:
+            if next(csv.reader(f), None) != [str(name) for name in header]:
+                sys.exit(f"{path} has different columns (the app's fields changed); export to a new directory")
+        new_file = False
+    else:
+        new_file = True
+    count = 0
+    with open(path, 'a', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        if new_file:
+            writer.writerow(header)
+        for row in rows:
+            writer.writerow(row)
+            count += 1
+    return count
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--out', required=True, help='directory for the CSV files and the cursor')
+    parser.add_argument('--session', help='only export this session (code)')
+    args = parser.parse_args(argv)
+    out_dir = Path(args.out).resolve()
+
+    os.chdir(PROJECT_DIR)
+    sys.path.insert(0, str(PROJECT_DIR))
+    from otree import settings
+    from otree.database import session_scope
+    from otree.main import setup
+
+    setup()
+
+    out_dir.mkdir(parents=True, exist_ok=True)
+    cursor = read_cursor(out_dir, args.session)
+    seen = cursor.get('recent', {})
+    recent = {}
+    upto = int(time.time())
+    with session_scope():
+        changed = changed_participants(cursor['last_page_timestamp'] - OVERLAP_SECONDS, upto, args.session)
+        # 下次运行会再次检查这些参与者
+        keep = {participant_id for participant_id, at in changed.items() if at > upto - OVERLAP_SECONDS}
+        for app_name in settings.OTREE_APPS:
+            rows = unseen_rows(app_rows(app_name, sorted(changed)), seen.get(app_name, {}), recent.setdefault(app_name, {}), keep)
+            count = append_rows(out_dir / f'{app_name}.csv', rows)
+            print(f"{app_name}: {count} rows")
+    write_cursor(out_dir, dict(
+        last_page_timestamp=upto, session=args.session, exported_at=time.strftime('%Y-%m-%d %H:%M:%S'), recent=recent,
+    ))
+    print(f"{len(changed)} participants changed since the last export (or in the {OVERLAP_SECONDS} seconds before it)")
+
+
+if __name__ == '__main__':
+    main()
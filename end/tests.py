@@ -0,0 +1,12 @@
+from otree.api import Currency as c, currency_range, expect, Bot, Submission
+from . import *
+from pre.tests import CASES
+
+
+class PlayerBot(Bot):
+    cases = CASES
+
+    def play_round(self):
+        # 未通过注意力检查的参与者直接进入 end2
+        if self.case != 'fail_all':
+            yield End
@@ -1,5 +1,7 @@
 from otree.api import *
 
+from template_warmup import warm_up
+
 
 doc = """
 Your app description
@@ -30,3 +32,6 @@ class End2(Page):
 
 
 page_sequence = [End2]
+
+# 启动时编译模板，第一个参与者不用等
+warm_up(__name__, page_sequence)
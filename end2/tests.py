@@ -0,0 +1,8 @@
+from otree.api import Currency as c, currency_range, expect, Bot, Submission
+from . import *
+
+
+class PlayerBot(Bot):
+    def play_round(self):
+        # End2 是最后一页，没有需要提交的页面
+        pass
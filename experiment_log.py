@@ -0,0 +1,77 @@
+"""
+Logging for the experiment apps.
+
+Records are handed to a queue and written by a background thread, so a slow
+log drain never blocks a page request. Each record can carry structured
+fields (session, participant, page), appended as key=value pairs:
+
+    log = player_logger(logger, player, 'Painting')
+    log.info("pair type recorded", extra=dict(pair_type='SAME'))
+
+Per-player detail is logged at DEBUG. The level comes from the
+EXPERIMENT_LOG_LEVEL environment variable (default INFO), so production
+only shows session-level events and problems; set it to DEBUG to trace
+individual participants.
+"""
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+
+LOG_LEVEL = os.environ.get('EXPERIMENT_LOG_LEVEL', 'INFO').upper()
+
+# standard LogRecord attributes; anything else on a record is a structured field
+_RECORD_ATTRS = set(vars(logging.makeLogRecord({}))) | {'message', 'asctime'}
+# shown first, in this order
+_CONTEXT_FIELDS = ('session', 'participant', 'page')
+
+
+class StructuredFormatter(logging.Formatter):
+    def format(self, record):
+        message = super().format(record)
+        fields = {k: v for k, v in vars(record).items() if k not in _RECORD_ATTRS}
+        ordered = [k for k in _CONTEXT_FIELDS if k in fields] + sorted(k for k in fields if k not in _CONTEXT_FIELDS)
+        pairs = ' '.join(f'{k}={fields[k]}' for k in ordered if fields[k] is not None)
+        return f'{message} {pairs}' if pairs else message
+
+
+_root = logging.getLogger('experiment')
+_listener = None
+
+
+def _configure():
+    global _listener
+    records = queue.SimpleQueue()
+    stream = logging.StreamHandler(sys.stdout)
+    stream.setFormatter(StructuredFormatter('%(levelname)s %(name)s: %(message)s'))
+    _listener = logging.handlers.QueueListener(records, stream)
+    _listener.start()
+    # flush what's still queued when the server exits
+    atexit.register(_listener.stop)
+
+    _root.addHandler(logging.handlers.QueueHandler(records))
+    _root.setLevel(LOG_LEVEL)
+    # don't also go through oTree's/uvicorn's root handlers
+    _root.propagate = False
+
+
+def get_logger(app_name):
+    if _listener is None:
+        _configure()
+    return _root.getChild(app_name)
+
+
+class _ContextAdapter(logging.LoggerAdapter):
+    def process(self, msg, kwargs):
+        kwargs['extra'] = {**self.extra, **kwargs.get('extra', {})}
+        return msg, kwargs
+
+
+def player_logger(logger, player, page=None):
+    """A logger that tags every record with the player's session, participant and page."""
+    return _ContextAdapter(
+        logger,
+        dict(session=player.session.code, participant=player.participant.code, page=page),
+    )
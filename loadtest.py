@@ -0,0 +1,465 @@
+"""
+Load generator for a Prolific launch into prolific_room.
+
+Start the server locally the way it runs in production (see Procfile), e.g.
+
+    otree resetdb --noinput
+    OTREE_PRODUCTION=1 otree prodserver 8000
+
+(set DATABASE_URL to a local Postgres to measure that instead of SQLite), then
+
+    python loadtest.py --url http://127.0.0.1:8000 --participants 300 --ramp 10
+
+This creates a session in the room through the REST API (OTREE_REST_KEY is
+sent if set), then simulated participants arrive at random times within
+--ramp seconds. Each one opens the room URL with a participant label, and
+works through the real pages with think times between them, posting forms
+such as Painting, Understanding and Audit. The attention check and the
+Understanding questions are answered over the pages' live websocket, as
+their JavaScript does; a wrong Understanding answer is changed like a person
+would. If the room has no session yet
+(--no-create-session), participants wait on the room's websocket until one is
+created.
+
+The report has latency percentiles per page: each POST plus the redirect to
+the next page, as the browser sees it. It also has per-page error rates
+(HTTP 5xx, timeouts and dropped connections) and form validation retries.
+Live messages are reported as '<page> live': each message until the reply.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import sys
+import time
+from collections import defaultdict
+from html.parser import HTMLParser
+from urllib.parse import urlencode, urljoin, urlsplit
+
+try:
+    import websockets
+except ImportError:  # installed with oTree's uvicorn; needed for live pages, otherwise room wait pages are polled
+    websockets = None
+
+ROOM_NAME = 'prolific_room'
+SESSION_CONFIG = 'your_experiment'
+PAINTINGS = {'Left': 'Klee', 'Right': 'Kandinsky'}
+ORGANIZATIONS = ['Red Cross', 'NRA']
+# 最后一页，到达即视为完成
+FINAL_PAGES = {'End', 'End2'}
+MAX_STEPS = 80
+# 表单连续被拒绝这么多次则视为卡住
+MAX_REJECTIONS = 5
+PAGE_PATH = re.compile(r'^/p/(?P<code>\w+)/(?P<app>\w+)/(?P<page>\w+)/(?P<index>\d+)')
+LIVE_SOCKET = re.compile(r'id="otree-live" data-socket-url="([^"]+)"')
+
+
+class RequestFailed(Exception):
+    pass
+
+
+class Response:
+    def __init__(self, status, headers, body, url):
+        self.status = status
+        self.headers = headers
+        self.body = body
+        self.url = url
+
+    @property
+    def text(self):
+        return self.body.decode('utf-8', 'replace')
+
+
+class HttpClient:
+    """Minimal HTTP/1.1 client: one keep-alive connection, like a browser tab."""
+
+    def __init__(self, base_url, timeout):
+        parts = urlsplit(base_url)
+        self.base_url = base_url
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.timeout = timeout
+        self.cookies = {}
+        self._reader = self._writer = None
+
+    async def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._reader = self._writer = None
+
+    async def _send(self, method, path, body, headers):
+        if self._writer is None:
+            self._reader, self._writer = await asyncio.open_connection(self.host, self.port)
+        lines = [f'{method} {path} HTTP/1.1', f'Host: {self.host}:{self.port}', 'Connection: keep-alive']
+        if self.cookies:
+            lines.append('Cookie: ' + '; '.join(f'{k}={v}' for k, v in self.cookies.items()))
+        if body is not None:
+            lines.append(f'Content-Length: {len(body)}')
+        lines += [f'{k}: {v}' for k, v in headers.items()]
+        self._writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + (body or b''))
+        await self._writer.drain()
+
+        status_line = await self._reader.readline()
+        if not status_line:
+            raise ConnectionResetError('connection closed by server')
+        status = int(status_line.split()[1])
+        response_headers = {}
+        while True:
+            line = (await self._reader.readline()).decode('latin-1').strip()
+            if not line:
+                break
+            name, _, value = line.partition(':')
+            name = name.lower()
+            value = value.strip()
+            if name == 'set-cookie':
+                cookie_name, _, cookie_value = value.split(';')[0].partition('=')
+                self.cookies[cookie_name] = cookie_value
+            response_headers[name] = value
+
+        if response_headers.get('transfer-encoding') == 'chunked':
+            chunks = []
+            while True:
+                size = int((await self._reader.readline()).split(b';')[0], 16)
+                chunk = await self._reader.readexactly(size + 2)
+                if size == 0:
+                    break
+                chunks.append(chunk[:-2])
+            content = b''.join(chunks)
+        elif 'content-length' in response_headers:
+            content = await self._reader.readexactly(int(response_headers['content-length']))
+        else:
+            content = await self._reader.read()
+            response_headers['connection'] = 'close'
+        if response_headers.get('connection') == 'close':
+            await self.close()
+        return status, response_headers, content
+
+    async def request(self, method, url, body=None, headers=None):
+        """Send a request and follow redirects. Raises RequestFailed on 5xx, timeouts and dropped connections."""
+        headers = headers or {}
+        for _ in range(10):
+            path = url[len(self.base_url):] if url.startswith(self.base_url) else url
+            try:
+                status, response_headers, content = await asyncio.wait_for(
+                    self._send(method, path, body, headers), self.timeout
+                )
+            except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError) as e:
+                await self.close()
+                raise RequestFailed(f'{type(e).__name__}: {e}') from None
+            if status >= 500:
+                raise RequestFailed(f'HTTP {status}')
+            if status in (301, 302, 303, 307) and 'location' in response_headers:
+                url = urljoin(self.base_url + path, response_headers['location'])
+                method, body, headers = 'GET', None, {}
+                continue
+            return Response(status, response_headers, content, url)
+        raise RequestFailed('too many redirects')
+
+
+class FormParser(HTMLParser):
+    """Collects the inputs of an oTree page form."""
+
+    def __init__(self):
+        super().__init__()
+        self.fields = {}
+        self._select = None
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        name = attrs.get('name')
+        if tag == 'input' and name:
+            kind = attrs.get('type', 'text')
+            field = self.fields.setdefault(name, {'type': kind, 'choices': []})
+            if kind in ('radio', 'checkbox'):
+                field['choices'].append(attrs.get('value', 'on'))
+            else:
+                field.update(
+                    value=attrs.get('value'),
+                    min=attrs.get('min'),
+                    max=attrs.get('max'),
+                    numeric=kind == 'number' or attrs.get('inputmode') in ('numeric', 'decimal'),
+                )
+        elif tag == 'textarea' and name:
+            self.fields[name] = {'type': 'text', 'choices': []}
+        elif tag == 'select' and name:
+            self._select = self.fields.setdefault(name, {'type': 'select', 'choices': []})
+        elif tag == 'option' and self._select is not None and attrs.get('value'):
+            self._select['choices'].append(attrs['value'])
+
+    def handle_endtag(self, tag):
+        if tag == 'select':
+            self._select = None
+
+
+def random_answers(html):
+    """Plausible answers for every field on the page."""
+    parser = FormParser()
+    parser.feed(html)
+    answers = {}
+    for name, field in parser.fields.items():
+        if field['choices']:
+            answers[name] = random.choice(field['choices'])
+        elif field['type'] == 'hidden':
+            answers[name] = field.get('value') or ''
+        elif field.get('numeric') or field.get('min') is not None:
+            # oTree renders currency and float fields as text inputs
+            low = int(float(field.get('min') or 0))
+            high = int(float(field.get('max') or low + 10))
+            answers[name] = str(random.randint(low, high))
+        else:
+            answers[name] = 'load test'
+    return answers
+
+
+class Participant:
+    """One simulated Prolific participant and the answers they need to remember."""
+
+    def __init__(self, label, options):
+        self.label = label
+        self.options = options
+        self.prefer = random.choice(list(PAINTINGS))
+        # Understanding 页面上逐题试出的正确答案
+        self.understanding = {}
+
+    def answers_for(self, page, html):
+        answers = random_answers(html)
+        if page == 'Preview':
+            answers['consent'] = 'True'
+        elif page == 'Painting':
+            answers['prefer'] = self.prefer
+        elif page == 'Understanding':
+            answers.update(self.understanding)
+        return answers
+
+    async def play_live(self, client, page, html, stats):
+        """Play a live page over its websocket."""
+        match = LIVE_SOCKET.search(html)
+        if websockets is None or not match:
+            raise RequestFailed('live page needs the websockets package')
+        ws_url = client.base_url.replace('http', 'ws', 1) + match.group(1).replace('&amp;', '&')
+        try:
+            async with websockets.connect(ws_url, open_timeout=client.timeout) as socket:
+
+                async def send(message):
+                    start = time.perf_counter()
+                    await socket.send(json.dumps(message))
+                    state = json.loads(await asyncio.wait_for(socket.recv(), client.timeout))
+                    stats.latencies[f'{page} live'].append((time.perf_counter() - start) * 1000)
+                    return state
+
+                if page == 'AttentionCheck':
+                    await self.attention_check(send)
+                elif page == 'Understanding':
+                    await self.understanding_check(send)
+        except (OSError, asyncio.TimeoutError, websockets.exceptions.WebSocketException) as e:
+            raise RequestFailed(f'{type(e).__name__}: {e}') from None
+
+    async def attention_check(self, send):
+        """Remember the number and recall it."""
+        state = await send(dict(type='load'))
+        while state['stage'] == 'remember':
+            number = state['number']
+            await asyncio.sleep(self.think_time())
+            await send(dict(type='remembered'))
+            await asyncio.sleep(self.think_time())
+            state = await send(dict(type='answer', value=number))
+        if state['stage'] != 'passed':
+            raise RequestFailed(f"attention check ended at {state['stage']}")
+
+    async def understanding_check(self, send):
+        """Answer each question; the manager's painting and the organization are guessed."""
+        guesses = dict(
+            choiceE=[PAINTINGS[self.prefer]],
+            choiceM=random.sample(list(PAINTINGS.values()), len(PAINTINGS)),
+            choiceT=random.sample(list(PAINTINGS.values()), len(PAINTINGS)),
+            choiceO=random.sample(ORGANIZATIONS, len(ORGANIZATIONS)),
+        )
+        for field, choices in guesses.items():
+            for value in choices:
+                await asyncio.sleep(self.think_time() / len(guesses))
+                if (await send(dict(field=field, value=value)))['correct']:
+                    self.understanding[field] = value
+                    break
+            else:
+                raise RequestFailed(f'no correct answer for {field}')
+
+    def think_time(self):
+        mean = self.options.think
+        return min(random.expovariate(1 / mean), 4 * mean) if mean > 0 else 0
+
+
+class Stats:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.retries = defaultdict(int)
+        self.completed = 0
+        self.abandoned = 0
+
+    def report(self, wall_seconds):
+        pages = sorted(set(self.latencies) | set(self.errors), key=lambda p: -len(self.latencies[p]))
+        print(f"\n{'page':<20} {'requests':>8} {'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8} {'max ms':>8} {'errors':>7} {'retries':>7}")
+        for page in pages:
+            ms = sorted(self.latencies[page])
+            total = len(ms) + self.errors[page]
+            figures = [percentile(ms, q) for q in (0.5, 0.9, 0.99)] + [ms[-1] if ms else 0]
+            error_rate = self.errors[page] / total if total else 0
+            print(
+                f"{page:<20} {total:>8} "
+                + ' '.join(f'{value:>8.0f}' for value in figures)
+                + f" {error_rate:>7.1%} {self.retries[page]:>7}"
+            )
+        requests = sum(len(ms) for ms in self.latencies.values()) + sum(self.errors.values())
+        print(f"\nParticipants completed: {self.completed}, abandoned after an error: {self.abandoned}")
+        print(f"Requests: {requests} in {wall_seconds:.1f} s ({requests / wall_seconds:.1f}/s)")
+        print(f"Error rate: {sum(self.errors.values()) / max(requests, 1):.2%}")
+
+    def as_dict(self):
+        return {
+            page: {
+                'requests': len(ms) + self.errors[page],
+                'p50_ms': percentile(sorted(ms), 0.5),
+                'p90_ms': percentile(sorted(ms), 0.9),
+                'p99_ms': percentile(sorted(ms), 0.99),
+                'errors': self.errors[page],
+                'retries': self.retries[page],
+            }
+            for page, ms in self.latencies.items()
+        }
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def page_name(url):
+    match = PAGE_PATH.match(urlsplit(url).path)
+    return match.group('page') if match else None
+
+
+async def wait_for_room_session(client, html):
+    """Block on the room's websocket until a session is created (or poll if websockets isn't installed)."""
+    match = re.search(r'(/wait_for_session_in_room\?[^"\']+)', html)
+    if websockets is None or not match:
+        await asyncio.sleep(2)
+        return
+    ws_url = client.base_url.replace('http', 'ws', 1) + match.group(1).replace('&amp;', '&')
+    async with websockets.connect(ws_url) as socket:
+        await socket.recv()
+
+
+async def run_participant(label, delay, options, stats):
+    await asyncio.sleep(delay)
+    participant = Participant(label, options)
+    client = HttpClient(options.url, options.timeout)
+    room_url = f'{options.url}/room/{ROOM_NAME}?' + urlencode({'participant_label': label})
+    page = 'room'
+    try:
+        start = time.perf_counter()
+        response = await client.request('GET', room_url)
+        while 'wait_for_session_in_room' in response.text:
+            await wait_for_room_session(client, response.text)
+            start = time.perf_counter()
+            response = await client.request('GET', room_url)
+        stats.latencies[page].append((time.perf_counter() - start) * 1000)
+
+        rejections = 0
+        for _ in range(MAX_STEPS):
+            page = page_name(response.url)
+            if page is None or page in FINAL_PAGES:
+                break
+            if LIVE_SOCKET.search(response.text):
+                await participant.play_live(client, page, response.text, stats)
+            answers = participant.answers_for(page, response.text)
+            await asyncio.sleep(participant.think_time())
+
+            start = time.perf_counter()
+            next_response = await client.request(
+                'POST',
+                response.url,
+                urlencode(answers).encode(),
+                {'Content-Type': 'application/x-www-form-urlencoded'},
+            )
+            stats.latencies[page].append((time.perf_counter() - start) * 1000)
+            if next_response.url == response.url:
+                # 表单未通过验证，页面重新显示
+                stats.retries[page] += 1
+                rejections += 1
+                if rejections >= MAX_REJECTIONS:
+                    raise RequestFailed('form rejected repeatedly')
+            else:
+                rejections = 0
+            response = next_response
+        stats.completed += 1
+    except RequestFailed as e:
+        stats.errors[page] += 1
+        stats.abandoned += 1
+        if options.verbose:
+            print(f"{label} {page}: {e}", file=sys.stderr)
+    finally:
+        await client.close()
+
+
+async def create_room_session(options):
+    client = HttpClient(options.url, options.timeout)
+    body = json.dumps(
+        dict(session_config_name=SESSION_CONFIG, num_participants=options.participants, room_name=ROOM_NAME)
+    ).encode()
+    headers = {'Content-Type': 'application/json'}
+    if os.environ.get('OTREE_REST_KEY'):
+        headers['otree-rest-key'] = os.environ['OTREE_REST_KEY']
+    try:
+        response = await client.request('POST', f'{options.url}/api/sessions', body, headers)
+    finally:
+        await client.close()
+    if response.status != 200:
+        sys.exit(f"Could not create session ({response.status}): {response.text[:200]}")
+    return json.loads(response.body)['code']
+
+
+async def main_async(options):
+    if options.create_session:
+        code = await create_room_session(options)
+        print(f"Created session {code} in {ROOM_NAME} for {options.participants} participants")
+
+    stats = Stats()
+    run_id = options.label_prefix or f'LT{int(time.time())}'
+    start = time.perf_counter()
+    await asyncio.gather(*[
+        run_participant(f'{run_id}_{i}', random.uniform(0, options.ramp), options, stats)
+        for i in range(options.participants)
+    ])
+    wall_seconds = time.perf_counter() - start
+
+    stats.report(wall_seconds)
+    if options.json:
+        with open(options.json, 'w') as f:
+            json.dump(stats.as_dict(), f, indent=2)
+    return 1 if stats.abandoned else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Simulate a Prolific launch against a running oTree server")
+    parser.add_argument('--url', default='http://127.0.0.1:8000')
+    parser.add_argument('--participants', type=int, default=100)
+    parser.add_argument('--ramp', type=float, default=10, help="participants arrive within this many seconds")
+    parser.add_argument('--think', type=float, default=5, help="mean think time per page in seconds (0 = none)")
+    parser.add_argument('--timeout', type=float, default=30, help="seconds before a request counts as failed")
+    parser.add_argument('--no-create-session', dest='create_session', action='store_false',
+                        help="use the session already open in the room")
+    parser.add_argument('--label-prefix', help="participant labels are <prefix>_<n>")
+    parser.add_argument('--json', help="also write per-page figures to this file")
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--verbose', action='store_true')
+    options = parser.parse_args(argv)
+    options.url = options.url.rstrip('/')
+    random.seed(options.seed)
+    return asyncio.run(main_async(options))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,18 +1,45 @@
+import logging
 import random
-import csv
 import os
+import time
+from array import array
+from collections import OrderedDict, defaultdict, namedtuple
+from functools import partial
 from otree.api import *
+from otree.database import db, engine
+from otree.models import Participant
+from sqlalchemy import Index, event
+from sqlalchemy.orm import joinedload
 from datetime import datetime
 
+import counters
+from asset_prefetch import attach_prefetch
+from dashboard import page_counter_names, page_rows, rate, track_pages
+from experiment_log import get_logger, player_logger
+from page_timing import instrument, timing_rows
+from static_images import install_cache_headers, picture
+from template_warmup import warm_up
+from .allocator import MAX_CACHED_SESSIONS, choose_same_pair, manager_queues, organization_for
+from .assignment_plan import NO_MANAGER, build_plan, load_plan
+from .manager_pool import (
+    MISSING, PAINTING_MAPPING, ManagerRecord, dump_manager_pool, load_manager_pool, parse_manager_pool,
+)
+# settle 也是子模块 main.settle 的名字，导入该模块后会覆盖这里的函数
+from .settlement import BASE_PAYMENT, manager_bonus, settle as settle_amounts, to_prolific
+
 doc = """
 Two-stage experiment with manager-employee matching
 """
 
 current_dir = os.path.dirname(os.path.abspath(__file__))
+logger = get_logger('main')
+# 带哈希的图片文件长期缓存
+install_cache_headers()
 
 class C(BaseConstants):
     NAME_IN_URL = 'main' 
-    PLAYERS_PER_GROUP = None
+    # 每人单独一组：oTree 每次回复 live_method 消息都会查询整组的玩家
+    PLAYERS_PER_GROUP = 1
     NUM_ROUNDS = 1
     PREFER_CHOICES = ['Left', 'Right']
     CHALLENGE_CHOICES = ['Red Cross', 'NRA']
@@ -34,6 +61,9 @@ class C(BaseConstants):
     
     # Path to the CSV file containing manager data
     MANAGER_DATA_PATH = current_dir + '/input.csv'
+    # Managers held by participants who haven't reached Audit after this long are reused
+    # (matches the 90-minute study time limit)
+    MANAGER_LEASE_MINUTES = 90
 
     # Big5
     CHOICES = range(1, 6)
@@ -124,6 +154,31 @@ class C(BaseConstants):
         "Other"
     ]
 
+    # 图片（python static_images.py 生成的缩小版本，按显示宽度选择）；Painting/Charity 页的大图在首屏，不延迟加载
+    PAINTING_SIZES = '13rem'
+    CARD_SIZES = '6rem'
+    LABEL_SIZES = '160px'
+    IMAGES = dict(
+        klee=picture('img/PaulKlee.jpg', 'Image 1', PAINTING_SIZES, loading='eager'),
+        kandinsky=picture('img/VassilyKandinsky.jpg', 'Image 2', PAINTING_SIZES, loading='eager'),
+        nra=picture('img/NRA.png', 'NRA', PAINTING_SIZES, loading='eager'),
+        red_cross=picture('img/RedCross.png', 'RedCross', PAINTING_SIZES, loading='eager'),
+        klee_card=picture('img/PaulKlee.jpg', 'Paul Klee Painting', CARD_SIZES, style='height: 6rem; width: auto;'),
+        kandinsky_card=picture('img/VassilyKandinsky.jpg', 'Vassily Kandinsky Painting', CARD_SIZES, style='height: 6rem; width: auto;'),
+        nra_card=picture('img/NRA.png', 'NRA', CARD_SIZES, style='height: 6rem; width: auto;'),
+        red_cross_card=picture('img/RedCross.png', 'Red Cross', CARD_SIZES, style='height: 6rem; width: auto;'),
+    )
+    LABEL_STYLE = 'width: 160px; max-width: 100%; height: auto;'
+    # 字段标签是普通字符串，用 f-string 拼接
+    CHARITY_LABEL_IMAGES = (
+        f"{picture('img/RedCross.png', 'Red Cross', LABEL_SIZES, style=LABEL_STYLE)}  "
+        f"{picture('img/NRA.png', 'NRA', LABEL_SIZES, style=LABEL_STYLE)}"
+    )
+    PAINTING_LABEL_IMAGES = (
+        f"{picture('img/PaulKlee.jpg', 'Klee', LABEL_SIZES, style=LABEL_STYLE)}  "
+        f"{picture('img/VassilyKandinsky.jpg', 'Kandinsky', LABEL_SIZES, style=LABEL_STYLE)}"
+    )
+
 
 class Subsession(BaseSubsession):
     pass
@@ -131,152 +186,140 @@ class Subsession(BaseSubsession):
 
 def creating_session(subsession: Subsession):
     """
-    预分配方案：在会话创建时就完成所有经理-员工的匹配
-    这样可以完全避免并发问题
+    初始化计数器并加载经理池。
+    经理在员工提交 Painting 时分配（见 assign_manager）：
+    manager_allocation='online' 时在线抽取（见 allocator.py），否则这里准备分配方案。
     """
     session = subsession.session
     
     # 初始化 session 变量
     session.vars['session_start_time'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-    session.vars['same_pairs_count'] = 0
-    session.vars['different_pairs_count'] = 0
+    counters.create_counters(
+        Counter, subsession,
+        PAIR_COUNTERS + DRAW_COUNTERS + [PLAN_NEXT, LEASES_TAKEN] + DASHBOARD_COUNTERS + page_counter_names(page_sequence),
+    )
     
-    # 加载 CSV 数据
-    if not os.path.exists(C.MANAGER_DATA_PATH):
-        print(f"\n❌ Manager data file not found: {C.MANAGER_DATA_PATH}")
-        print(f"   Current directory: {current_dir}")
-        print(f"   Please ensure input.csv exists in the correct location")
-        return
+    # 加载经理池（进程内缓存，文件未变时不重新解析）。
+    # 缺少或无法读取 input.csv 时让创建会话失败，而不是留下一个没有经理的会话
+    pool = load_manager_pool(C.MANAGER_DATA_PATH)
+    # 参与者只保存经理池中的行号，这里记录对应的经理池版本（并在数据库中保存一份）
+    session.vars['manager_pool_digest'] = pool.digest
+    save_pool_snapshot(pool)
     
-    try:
-        # 读取 CSV
-        manager_data = []
-        header = []
-        with open(C.MANAGER_DATA_PATH, 'r', encoding='utf-8-sig') as csvfile:
-            csv_reader = csv.reader(csvfile)
-            header = next(csv_reader)
-            for row in csv_reader:
-                manager_data.append(row)
-        
-        column_indices = {name: idx for idx, name in enumerate(header)}
-        
-        # 获取所有玩家
-        players = subsession.get_players()
-        num_players = len(players)
-        num_managers = len(manager_data)
-        
-        print(f"\n{'='*50}")
-        print(f"SESSION INITIALIZATION - PRE-ALLOCATION")
-        print(f"{'='*50}")
-        print(f"Session code: {session.code}")
-        print(f"Session start: {session.vars['session_start_time']}")
-        print(f"Players in session: {num_players}")
-        print(f"Managers available: {num_managers}")
-        print(f"CSV columns: {header}")
-        
-        if num_managers < num_players:
-            print(f"\n⚠️  WARNING: Not enough managers!")
-            print(f"   Need: {num_players}")
-            print(f"   Have: {num_managers}")
-            print(f"   Shortage: {num_players - num_managers}")
-            print(f"\n   Proceeding with available managers...")
-        else:
-            print(f"\n✓ Sufficient managers available")
-            print(f"  Surplus: {num_managers - num_players}")
-        
-        # 关键列索引
-        id_column = column_indices.get('participantid_in_session', -1)
-        prefer_column = column_indices.get('main1playerprefer', -1)
-        stated_column = column_indices.get('main1playerstated_amount', -1)
-        correct_column = column_indices.get('main1playerbriefing_correct_amou', -1)
-        threshold_column = column_indices.get('main1playerthreshold_integer', -1)
-        
-        if id_column == -1 or prefer_column == -1:
-            print("❌ ERROR: Required columns not found in CSV")
-            return
-        
-        # 分离 Left 和 Right 经理
-        managers_left = [m for m in manager_data if m[prefer_column] == 'Left']
-        managers_right = [m for m in manager_data if m[prefer_column] == 'Right']
-        
-        print(f"\nManager distribution:")
-        print(f"  Left preference: {len(managers_left)}")
-        print(f"  Right preference: {len(managers_right)}")
-        
-        # 打乱两组经理
-        random.shuffle(managers_left)
-        random.shuffle(managers_right)
-        
-        # 平衡分配策略：交替分配 Left 和 Right 经理
-        assigned_managers = []
-        left_idx = 0
-        right_idx = 0
-        
-        for i in range(num_players):
-            # 交替分配，确保平衡
-            if i % 2 == 0:
-                # 优先分配 Left
-                if left_idx < len(managers_left):
-                    assigned_managers.append(managers_left[left_idx])
-                    left_idx += 1
-                elif right_idx < len(managers_right):
-                    assigned_managers.append(managers_right[right_idx])
-                    right_idx += 1
-            else:
-                # 优先分配 Right
-                if right_idx < len(managers_right):
-                    assigned_managers.append(managers_right[right_idx])
-                    right_idx += 1
-                elif left_idx < len(managers_left):
-                    assigned_managers.append(managers_left[left_idx])
-                    left_idx += 1
-        
-        # 分配给每个玩家
-        painting_mapping = {'Left': 'Klee', 'Right': 'Kandinsky'}
-        
-        for i, player in enumerate(players):
-            if i < len(assigned_managers):
-                manager_row = assigned_managers[i]
-                
-                # 提取经理数据
-                manager_id = manager_row[id_column]
-                manager_prefer = manager_row[prefer_column]
-                
-                # 安全提取其他字段
-                def get_value(col_idx, default="Not available"):
-                    if col_idx != -1 and col_idx < len(manager_row):
-                        return manager_row[col_idx]
-                    return default
-                
-                manager_stated = get_value(stated_column)
-                manager_correct = get_value(correct_column)
-                manager_threshold = get_value(threshold_column, "8")
-                
-                # 存储到 participant.vars（跨 app 持久化）
-                player.participant.vars['assigned_manager'] = {
-                    'id': manager_id,
-                    'prefer': manager_prefer,
-                    'team': painting_mapping.get(manager_prefer, "Not assigned"),
-                    'organization': random.choice(C.CHALLENGE_CHOICES),
-                    'stated_amount': manager_stated,
-                    'correct_amount': manager_correct,
-                    'threshold_integer': manager_threshold,
-                    'assignment_order': i + 1,
-                    'assignment_timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                }
-                
-                print(f"✓ Player {i+1} assigned Manager {manager_id} (Prefer: {manager_prefer})")
+    num_players = session.num_participants
+    num_managers = len(pool)
+    
+    logger.info(
+        "Session initialization",
+        extra=dict(
+            session=session.code,
+            players=num_players,
+            managers=num_managers,
+            left=len(pool.left_indices),
+            right=len(pool.right_indices),
+        ),
+    )
+    
+    if num_managers < num_players:
+        logger.warning(
+            "Not enough managers: %s",
+            'managers will be reused' if session.config.get('manager_replacement') else 'proceeding with available managers',
+            extra=dict(session=session.code, shortage=num_players - num_managers),
+        )
+    
+    # 按跨会话使用次数排序，优先使用用得少的经理
+    session.vars['manager_usage'] = usage_snapshot(pool)
+    
+    # 两种模式下经理都只在员工提交 Painting 时才绑定（租约），
+    # 在 pre 中退出的参与者不会占用经理
+    if session.config.get('manager_allocation') == 'online':
+        # 在线分配：员工提交 Painting 时才抽取经理
+        session.vars['allocation_seed'] = random.getrandbits(32)
+        logger.info("Managers will be drawn online when employees submit Painting", extra=dict(session=session.code))
+    else:
+        prepare_plan(session, pool, num_players)
+
+
+def prepare_plan(session, pool, num_players):
+    """
+    预分配方案：在会话创建时确定分配方案（离线编译的文件，或由随机种子现场生成）。
+    方案中的位置按员工提交 Painting 的顺序依次使用，见 claim_planned_manager。
+    """
+    plan_path = session.config.get('assignment_plan')
+    if plan_path:
+        try:
+            with load_plan(plan_path, pool, C.CHALLENGE_CHOICES) as plan:
+                num_slots = len(plan)
+            logger.info("Using compiled assignment plan", extra=dict(session=session.code, path=plan_path, slots=num_slots))
+            if num_slots < num_players:
+                logger.warning("Plan has too few slots, building inline instead", extra=dict(session=session.code, slots=num_slots))
             else:
-                print(f"❌ Player {i+1} could not be assigned (no managers left)")
-        
-        print(f"\n{'='*50}")
-        print(f"PRE-ALLOCATION COMPLETE")
-        print(f"{'='*50}\n")
-        
-    except Exception as e:
-        print(f"\n❌ Error during pre-allocation: {e}")
-        import traceback
-        traceback.print_exc()
+                session.vars['assignment_plan_path'] = plan_path
+                return
+        except (OSError, ValueError) as e:
+            logger.warning("Could not load assignment plan, building inline instead: %s", e, extra=dict(session=session.code))
+    session.vars['plan_seed'] = random.getrandbits(32)
+
+
+# session code -> AssignmentPlan, built or mapped once per process; most recently used last
+_session_plans = OrderedDict()
+
+
+def session_plan(session, pool):
+    plan = _session_plans.get(session.code)
+    if plan is not None:
+        _session_plans.move_to_end(session.code)
+    else:
+        plan_path = session.vars.get('assignment_plan_path')
+        if plan_path:
+            plan = load_plan(plan_path, pool, C.CHALLENGE_CHOICES)
+        else:
+            rng = random.Random(session.vars['plan_seed'])
+            plan = build_plan(
+                pool, session.num_participants, C.CHALLENGE_CHOICES, rng,
+                usage=session_usage(session), replacement=session.config.get('manager_replacement'),
+            )
+        _session_plans[session.code] = plan
+        # 较早的会话（多半已结束）被移出缓存，需要时重新生成或映射
+        if len(_session_plans) > MAX_CACHED_SESSIONS:
+            _, evicted = _session_plans.popitem(last=False)
+            evicted.close()
+    return plan
+
+
+def vars_for_admin_report(subsession: Subsession):
+    """实时进度：所有数字来自计数器（页面提交时递增），不遍历玩家"""
+    # 本功能之前创建的会话没有这些计数器
+    counts = defaultdict(int, get_counters(subsession))
+    return dict(
+        page_timings=timing_rows(__name__),
+        pages=page_rows(page_sequence, counts),
+        same_pairs=counts[SAME_PAIRS],
+        different_pairs=counts[DIFFERENT_PAIRS],
+        managers_remaining=managers_remaining(subsession.session, counts),
+        understanding_done=counts[UNDERSTANDING_DONE],
+        understanding_first_try_rate=rate(counts[UNDERSTANDING_FIRST_TRY], counts[UNDERSTANDING_DONE]),
+        audits=counts[AUDITS],
+        report_rate=rate(counts[REPORTS], counts[AUDITS]),
+    )
+
+
+def managers_remaining(session, counts):
+    """Managers not yet handed out (including ones freed from expired leases)."""
+    if session.config.get('manager_replacement'):
+        return 'unlimited (managers are reused)'
+    pool = session_pool(session)
+    if pool is None:
+        return '–'
+    if session.config.get('manager_allocation') == 'online':
+        drawn = (
+            min(counts['drawn_Left'], len(pool.left_indices))
+            + min(counts['drawn_Right'], len(pool.right_indices))
+        )
+    else:
+        # 方案中前 len(pool) 个位置的经理互不相同
+        drawn = min(counts[PLAN_NEXT], len(pool))
+    return len(pool) - drawn + counts[FREE_MANAGERS]
 
 
 class Group(BaseGroup):
@@ -306,7 +349,7 @@ class Player(BasePlayer):
         widget=widgets.RadioSelectHorizontal
     )
     charity_1 = models.StringField(
-        label="<img src='/static/img/RedCross.png' style='width: 160px; max-width: 100%;'>  <img src='/static/img/NRA.png' style='width: 160px; max-width: 100%;'><br><br>Which charity do you identify with?",
+        label=C.CHARITY_LABEL_IMAGES + "<br><br>Which charity do you identify with?",
         choices=C.CHALLENGE_CHOICES,
         widget=widgets.RadioSelectHorizontal
     )
@@ -324,9 +367,13 @@ class Player(BasePlayer):
         max=100,
     )
     report = models.BooleanField()
+    # 结算结果（python -m main.settle），每人只结算一次
+    manager_bonus = models.CurrencyField()
+    manager_payment = models.CurrencyField()
+    settled_at = models.FloatField()
     
     choiceE = models.CharField(
-        label="<img src='/static/img/PaulKlee.jpg' style='width: 160px; max-width: 100%;'>  <img src='/static/img/VassilyKandinsky.jpg' style='width: 160px; max-width: 100%;'><br><br>1) Please indicate the painting that <b>you selected</b> at the beginning of the game:<br>",
+        label=C.PAINTING_LABEL_IMAGES + "<br><br>1) Please indicate the painting that <b>you selected</b> at the beginning of the game:<br>",
         choices=["Klee", "Kandinsky"],
         widget=widgets.RadioSelectHorizontal,
         blank=False
@@ -347,7 +394,7 @@ class Player(BasePlayer):
     )
 
     choiceO = models.CharField(
-        label="<br><img src='/static/img/RedCross.png' style='width: 160px; max-width: 100%;'>  <img src='/static/img/NRA.png' style='width: 160px; max-width: 100%;'><br><br>4) Please indicate the charity that your <b>organization donated to</b>:<br>",
+        label="<br>" + C.CHARITY_LABEL_IMAGES + "<br><br>4) Please indicate the charity that your <b>organization donated to</b>:<br>",
         choices=["Red Cross", "NRA"],
         widget=widgets.RadioSelectHorizontal,
         blank=False
@@ -423,46 +470,556 @@ class Player(BasePlayer):
     )
 
 
+# python delta_export.py 按这两列查找上次导出后变化的参与者
+Index('otree_participant_last_page_timestamp', Participant._last_page_timestamp)
+Index('main_player_settled_at', Player.settled_at)
+
+
+class Counter(ExtraModel):
+    """Per-session counters (e.g. same/different pair totals), see counters.py."""
+    subsession = models.Link(Subsession)
+    name = models.StringField()
+    value = models.IntegerField(initial=0)
+
+
+counters.index_counters(Counter)
+increment_counter = partial(counters.increment_counter, Counter)
+increment_and_get = partial(counters.increment_and_get, Counter)
+get_counters = partial(counters.get_counters, Counter)
+
+
+class ManagerPoolSnapshot(ExtraModel):
+    """
+    The pool columns of each version of input.csv that sessions were created
+    with (see session_pool), so a running session keeps its managers when the
+    file is edited or replaced.
+    """
+    digest = models.StringField()
+    columns = models.LongStringField()
+
+
+Index('main_managerpoolsnapshot_digest', ManagerPoolSnapshot.digest, unique=True)
+
+
+class ManagerLease(ExtraModel):
+    """
+    A manager bound to a participant when they enter main.
+    Active leases older than C.MANAGER_LEASE_MINUTES are considered abandoned
+    and their manager goes back to the free list; Audit completes the lease.
+    """
+    subsession = models.Link(Subsession)
+    participant_code = models.StringField()
+    manager_ref = models.IntegerField()
+    leased_at = models.FloatField()
+    state = models.StringField()
+
+
+# complete_lease 和 release_expired_leases 的查询条件（参与者 code 全局唯一；进行中的租约很少）
+Index('main_managerlease_participant_code', ManagerLease.participant_code)
+Index('main_managerlease_state', ManagerLease.state, ManagerLease.leased_at)
+
+
+LEASE_ACTIVE = 'active'
+LEASE_COMPLETED = 'completed'
+LEASE_RELEASED = 'released'
+
+
+class ManagerUsage(ExtraModel):
+    """
+    Cross-session ledger: how many participants each manager in input.csv
+    (participantid_in_session) has been matched with, over all sessions.
+    One row per manager (unique index on manager_id).
+    """
+    manager_id = models.IntegerField()
+    uses = models.IntegerField(initial=0)
+
+
+Index('main_managerusage_manager_id', ManagerUsage.manager_id, unique=True)
+
+
+class ManagerTally(ExtraModel):
+    """
+    Cross-session settlement per manager in input.csv: employees matched and
+    settled, how many of them reported, and the bonuses they are owed in total
+    (USD; the base payment is their Prolific study reward).
+    Updated by settle_session, one row per manager (unique index on manager_id).
+    """
+    manager_id = models.IntegerField()
+    prolific_id = models.StringField()
+    matches = models.IntegerField(initial=0)
+    reports = models.IntegerField(initial=0)
+    payable = models.FloatField(initial=0)
+
+
+Index('main_managertally_manager_id', ManagerTally.manager_id, unique=True)
+
+
+def insert_missing(model, rows):
+    """
+    Insert rows (dicts of column values) into model's table, skipping those
+    that another process has inserted first (a conflict on a unique index).
+    """
+    if not rows:
+        return
+    table = model.__table__
+    if engine.dialect.name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+
+        statement = insert(table).on_conflict_do_nothing()
+    elif engine.dialect.name == 'mysql':
+        statement = table.insert().prefix_with('IGNORE')
+    else:
+        statement = table.insert().prefix_with('OR IGNORE')
+    # 与 ORM 对象在同一个事务中执行
+    db.query(model).session.execute(statement, rows)
+
+
+def record_settlements(pool, rows, reports, bonuses):
+    """Add newly settled matches (pool rows, report flags, bonuses) to the managers' tallies."""
+    batch = {}
+    for row, report, bonus in zip(rows, reports, bonuses):
+        matches, reported, payable = batch.get(row, (0, 0, 0.0))
+        batch[row] = (matches + 1, reported + bool(report), payable + bonus)
+    ids = [pool.ids[row] for row in batch]
+    known = {manager_id for manager_id, in db.query(ManagerTally.manager_id).filter(ManagerTally.manager_id.in_(ids))}
+    # 另一个结算同时添加的经理：冲突的行跳过，下面的 UPDATE 照样累加
+    insert_missing(ManagerTally, [
+        dict(manager_id=pool.ids[row], prolific_id=pool.prolific_ids[row], matches=0, reports=0, payable=0.0)
+        for row in batch if pool.ids[row] not in known
+    ])
+    for row, (matches, reported, payable) in batch.items():
+        manager_id = pool.ids[row]
+        # 原子更新，两个进程同时结算也不会丢失
+        db.query(ManagerTally).filter_by(manager_id=manager_id).update(
+            {
+                ManagerTally.matches: ManagerTally.matches + matches,
+                ManagerTally.reports: ManagerTally.reports + reported,
+                ManagerTally.payable: ManagerTally.payable + payable,
+            },
+            synchronize_session=False,
+        )
+
+
+def manager_tally(manager_id):
+    """A manager's settlement over all sessions as a dict, or None if they have none yet."""
+    tally = db.query(ManagerTally).filter_by(manager_id=manager_id).one_or_none()
+    if tally is None:
+        return None
+    return dict(
+        manager_id=tally.manager_id, prolific_id=tally.prolific_id,
+        matches=tally.matches, reports=tally.reports, payable=round(tally.payable, 2),
+    )
+
+
+def manager_tally_rows():
+    """The whole tally table, ordered by manager ID, as tuples (header first)."""
+    columns = (ManagerTally.manager_id, ManagerTally.prolific_id, ManagerTally.matches, ManagerTally.reports, ManagerTally.payable)
+    yield tuple(column.key for column in columns)
+    yield from db.query(*columns).order_by(ManagerTally.manager_id)
+
+
+def record_manager_use(manager_id, by=1):
+    db.query(ManagerUsage).filter_by(manager_id=manager_id).update(
+        {ManagerUsage.uses: ManagerUsage.uses + by}, synchronize_session=False
+    )
+
+
+def usage_snapshot(pool):
+    """
+    Current ledger counts indexed by pool row (as bytes of an array('I'), for session.vars).
+    Adds ledger rows for managers that are new in input.csv.
+    """
+    uses = dict(db.query(ManagerUsage.manager_id, ManagerUsage.uses))
+    # 两个会话同时创建时可能都要添加同一经理：冲突的行跳过
+    insert_missing(ManagerUsage, [dict(manager_id=manager_id, uses=0) for manager_id in pool.ids if manager_id not in uses])
+    return array('I', [uses.get(manager_id, 0) for manager_id in pool.ids]).tobytes()
+
+
+def session_usage(session):
+    """The usage snapshot taken when the session was created."""
+    usage = array('I')
+    usage.frombytes(session.vars['manager_usage'])
+    return usage
+
+
+class FreeManager(ExtraModel):
+    """Managers released from abandoned leases, reused before drawing new ones."""
+    subsession = models.Link(Subsession)
+    manager_ref = models.IntegerField()
+    side = models.IntegerField()
+
+
+# subsession_id 列由 Link 在映射配置时才生成，索引只能在那之后定义
+@event.listens_for(FreeManager, 'mapper_configured')
+def _index_free_managers(mapper, cls):
+    Index('main_freemanager_subsession', cls.subsession_id, cls.side)
+
+
+
+SAME_PAIRS = 'same_pairs'
+DIFFERENT_PAIRS = 'different_pairs'
+PAIR_COUNTERS = [SAME_PAIRS, DIFFERENT_PAIRS]
+# managers drawn so far from each prefer side (online allocation)
+DRAW_COUNTERS = ['drawn_Left', 'drawn_Right']
+# next unused slot of the assignment plan (preallocate mode)
+PLAN_NEXT = 'plan_next'
+LEASES_TAKEN = 'leases_taken'
+# 管理员报告用
+FREE_MANAGERS = 'free_managers'
+UNDERSTANDING_DONE = 'understanding_done'
+UNDERSTANDING_FIRST_TRY = 'understanding_first_try'
+AUDITS = 'audits'
+REPORTS = 'reports'
+DASHBOARD_COUNTERS = [FREE_MANAGERS, UNDERSTANDING_DONE, UNDERSTANDING_FIRST_TRY, AUDITS, REPORTS]
+
+
+AssignedManager = namedtuple('AssignedManager', ManagerRecord._fields + ('organization',))
+
+
+def manager_ref(manager_row, organization_code):
+    """Pack a manager pool row and an index into C.CHALLENGE_CHOICES into one small int."""
+    return manager_row * len(C.CHALLENGE_CHOICES) + organization_code
+
+
+def save_pool_snapshot(pool):
+    """Store the pool's columns under its digest, unless a session already stored this version."""
+    if db.query(ManagerPoolSnapshot.id).filter_by(digest=pool.digest).first() is None:
+        # 两个会话同时创建时，后插入的一行跳过
+        insert_missing(ManagerPoolSnapshot, [dict(digest=pool.digest, columns=dump_manager_pool(pool))])
+
+
+# digest -> ManagerPool, for versions of input.csv that are no longer the current file
+_snapshot_pools = {}
+
+
+def session_pool(session):
+    """
+    The manager pool the session was created with: the cached input.csv if it
+    is unchanged, otherwise the snapshot stored when the session was created.
+    None if the session has no manager pool.
+    """
+    digest = session.vars.get('manager_pool_digest')
+    if digest is None:
+        return None
+    try:
+        pool = load_manager_pool(C.MANAGER_DATA_PATH)
+    except (OSError, ValueError):
+        pool = None
+    if pool is not None and pool.digest == digest:
+        return pool
+
+    pool = _snapshot_pools.get(digest)
+    if pool is None:
+        columns = db.query(ManagerPoolSnapshot.columns).filter_by(digest=digest).scalar()
+        if columns is None:
+            logger.error("No stored manager pool for the session", extra=dict(session=session.code, digest=digest))
+            return None
+        # input.csv 在会话创建后被修改过：使用会话创建时保存的版本
+        pool = parse_manager_pool(columns.encode('utf-8'), C.MANAGER_DATA_PATH, digest)
+        _snapshot_pools[digest] = pool
+        logger.info("input.csv changed since the session was created; using its stored pool", extra=dict(session=session.code))
+    return pool
+
+
+def assigned_manager(participant):
+    """
+    The manager assigned to a participant, as an AssignedManager,
+    or None if the participant has none.
+    """
+    ref = participant.vars.get('manager_ref')
+    if ref is None:
+        return None
+    pool = session_pool(participant.session)
+    if pool is None:
+        return None
+    manager_row, organization_code = divmod(ref, len(C.CHALLENGE_CHOICES))
+    return AssignedManager(*pool.record(manager_row), C.CHALLENGE_CHOICES[organization_code])
+
+
+def manager_side(pool, ref):
+    """Prefer side (index into C.PREFER_CHOICES) of the manager in a manager_ref."""
+    return pool.prefer[ref // len(C.CHALLENGE_CHOICES)]
+
+
+def lease_manager(player: Player, pool, ref):
+    player.participant.vars['manager_ref'] = ref
+    record_manager_use(pool.ids[ref // len(C.CHALLENGE_CHOICES)])
+    # 分配顺序：第几个领取经理的参与者
+    player.manager_match_order = increment_and_get(player.subsession, LEASES_TAKEN)
+    ManagerLease.create(
+        subsession=player.subsession,
+        participant_code=player.participant.code,
+        manager_ref=ref,
+        leased_at=time.time(),
+        state=LEASE_ACTIVE,
+    )
+
+
+def complete_lease(player: Player):
+    """
+    Mark the player's lease completed. If it had expired and was released
+    while the participant was still playing, the match did happen after all:
+    take the manager back off the free list (unless it has been handed out
+    again meanwhile) and count the use again.
+    """
+    subsession = player.subsession
+    leases = db.query(ManagerLease).filter_by(subsession_id=subsession.id, participant_code=player.participant.code)
+    completed = {ManagerLease.state: LEASE_COMPLETED}
+    if leases.filter_by(state=LEASE_ACTIVE).update(completed, synchronize_session=False):
+        return
+    if not leases.filter_by(state=LEASE_RELEASED).update(completed, synchronize_session=False):
+        return
+    ref = player.participant.vars['manager_ref']
+    if take_free_manager(db.query(FreeManager).filter_by(subsession_id=subsession.id, manager_ref=ref)) is not None:
+        increment_counter(subsession, FREE_MANAGERS, -1)
+    pool = session_pool(player.session)
+    if pool is not None:
+        record_manager_use(pool.ids[ref // len(C.CHALLENGE_CHOICES)])
+    player_logger(logger, player, 'Audit').warning("Completed a lease that had been released", extra=dict(manager_ref=ref))
+
+
+def push_free_manager(subsession, ref, side):
+    FreeManager.create(subsession=subsession, manager_ref=ref, side=side)
+    increment_counter(subsession, FREE_MANAGERS)
+
+
+def take_free_manager(query):
+    """Delete the newest FreeManager row of query and return its manager_ref, or None if there is none."""
+    while True:
+        free = query.with_entities(FreeManager.id, FreeManager.manager_ref).order_by(FreeManager.id.desc()).first()
+        if free is None:
+            return None
+        # 条件删除：另一个进程已经取走这一行时删除 0 行，换下一行
+        if db.query(FreeManager).filter_by(id=free.id).delete(synchronize_session=False):
+            return free.manager_ref
+
+
+def pop_free_manager(subsession, side=None):
+    """Take the most recently freed manager (of the given side, if any). Returns a manager_ref or None."""
+    query = db.query(FreeManager).filter_by(subsession_id=subsession.id)
+    if side is not None:
+        query = query.filter_by(side=side)
+    ref = take_free_manager(query)
+    if ref is not None:
+        increment_counter(subsession, FREE_MANAGERS, -1)
+    return ref
+
+
+def release_expired_leases(subsession, pool):
+    """Return managers of abandoned leases to the free list. Returns how many were released."""
+    cutoff = time.time() - C.MANAGER_LEASE_MINUTES * 60
+    expired = db.query(ManagerLease.id, ManagerLease.manager_ref).filter(
+        ManagerLease.subsession_id == subsession.id,
+        ManagerLease.state == LEASE_ACTIVE,
+        ManagerLease.leased_at < cutoff,
+    ).all()
+    released = 0
+    for lease_id, ref in expired:
+        # 条件更新：同时完成或被另一个进程释放的租约不重复放回
+        if not db.query(ManagerLease).filter_by(id=lease_id, state=LEASE_ACTIVE).update(
+            {ManagerLease.state: LEASE_RELEASED}, synchronize_session=False
+        ):
+            continue
+        push_free_manager(subsession, ref, manager_side(pool, ref))
+        # 被放弃的匹配不计入使用次数，经理再次分配（或原参与者仍完成了 Audit，见 complete_lease）时重新计数
+        record_manager_use(pool.ids[ref // len(C.CHALLENGE_CHOICES)], -1)
+        released += 1
+    if released:
+        logger.info("Released %d expired manager lease(s)", released, extra=dict(session=subsession.session.code))
+    return released
+
+
+def allocate_manager(player: Player):
+    """
+    在线分配：根据员工的 prefer 和当前 same/different 计数抽取经理（见 allocator.py）。
+    先复用被释放的经理，再从队列中抽取新经理。Returns False if no manager is left.
+    """
+    subsession = player.subsession
+    seed = player.session.vars['allocation_seed']
+    pool = session_pool(player.session)
+    if pool is None:
+        return False
+    queues = manager_queues(pool, seed, session_usage(player.session))
+    replacement = player.session.config.get('manager_replacement')
+    
+    counts = get_counters(subsession)
+    employee_side = C.PREFER_CHOICES.index(player.prefer)
+    if choose_same_pair(counts[SAME_PAIRS], counts[DIFFERENT_PAIRS]):
+        sides = [employee_side, 1 - employee_side]
+    else:
+        sides = [1 - employee_side, employee_side]
+    
+    # 目标一侧的经理用完时，从另一侧补充
+    for side in sides:
+        ref = pop_free_manager(subsession, side)
+        if ref is None:
+            draw = increment_and_get(subsession, DRAW_COUNTERS[side]) - 1
+            if draw < len(queues[side]):
+                organization = organization_for(seed, side, draw, len(C.CHALLENGE_CHOICES))
+                ref = manager_ref(queues[side][draw], organization)
+        if ref is not None:
+            lease_manager(player, pool, ref)
+            return True
+    
+    # 经理全部用完：回收超时未完成者的经理后再试一次
+    if release_expired_leases(subsession, pool):
+        for side in sides:
+            ref = pop_free_manager(subsession, side)
+            if ref is not None:
+                lease_manager(player, pool, ref)
+                return True
+    
+    # 放回抽样模式：重复使用经理（仍然优先用得少的）
+    if replacement:
+        for side in sides:
+            if queues[side]:
+                draw = increment_and_get(subsession, DRAW_COUNTERS[side]) - 1
+                organization = organization_for(seed, side, draw, len(C.CHALLENGE_CHOICES))
+                lease_manager(player, pool, manager_ref(queues[side][draw % len(queues[side])], organization))
+                return True
+    return False
+
+
+def claim_planned_manager(player: Player):
+    """
+    预分配模式：员工提交 Painting 时取分配方案中的下一个位置。
+    Returns False if the plan has no manager left.
+    """
+    subsession = player.subsession
+    pool = session_pool(player.session)
+    if pool is None:
+        return False
+    
+    ref = pop_free_manager(subsession)
+    if ref is None:
+        plan = session_plan(player.session, pool)
+        slot = increment_and_get(subsession, PLAN_NEXT) - 1
+        if slot < len(plan) and plan.manager_index[slot] != NO_MANAGER:
+            ref = manager_ref(plan.manager_index[slot], plan.organization[slot])
+    if ref is None and release_expired_leases(subsession, pool):
+        ref = pop_free_manager(subsession)
+    if ref is None:
+        return False
+    lease_manager(player, pool, ref)
+    return True
+
+
+def assign_manager(player: Player):
+    """
+    唯一的经理分配入口（员工提交 Painting 时调用）：
+    在线模式按配对平衡抽取，预分配模式领取分配方案中的下一个位置，然后写入 Player 字段。
+    """
+    if player.session.config.get('manager_allocation') == 'online':
+        allocate_manager(player)
+    else:
+        claim_planned_manager(player)
+    return bind_manager(player)
+
+
+def manager_fields(manager):
+    """Player column values for an AssignedManager."""
+    return {
+        'matched_manager_id': str(manager.id),
+        'group_manager_id': str(manager.id),
+        'group_manager_prefer': manager.prefer,
+        'group_prefer': manager.prefer,
+        'group_team': manager.team,
+        'group_organization': manager.organization,
+        'manager_stated_amount': amount_label(manager.stated_amount),
+        'manager_correct_amount': amount_label(manager.correct_amount),
+        'manager_threshold_integer': str(manager.threshold_integer),
+        'manager_match_timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+    }
+
+
+def bind_manager(player: Player):
+    """
+    把分配到的经理数据写入 Player 字段（同一请求内一次 UPDATE 写入）。
+    Returns False if the player has no manager.
+    """
+    manager = assigned_manager(player.participant)
+    log = player_logger(logger, player, 'bind_manager')
+    
+    if not manager:
+        log.error("Player has no assigned manager")
+        player.matched_manager_id = "ERROR_NO_ASSIGNMENT"
+        return False
+    
+    for field, value in manager_fields(manager).items():
+        setattr(player, field, value)
+    refresh_manager_context(player)
+    
+    log.debug(
+        "Manager bound",
+        extra=dict(
+            manager=manager.id,
+            manager_prefer=manager.prefer,
+            organization=manager.organization,
+            order=player.field_maybe_none('manager_match_order'),
+        ),
+    )
+    return True
+
+
+# 页面模板共用的默认值（尚未绑定经理时）
+DEFAULT_CONTEXT = {
+    'manager_id': 'Not matched',
+    'manager_prefer': 'Not available',
+    'team': 'Not assigned',
+    'organization': 'Not assigned',
+    'stated_amount': 'Not available',
+    'correct_amount': 'Not available',
+    'threshold_integer': '8',
+    'player_prefer': None,
+    'group_prefer': None,
+}
+
+
+def refresh_manager_context(player: Player):
+    """
+    计算一次页面共用的经理/团队/组织信息和 Understanding 的答案，缓存在 participant.vars 中。
+    绑定经理时和员工选择画作后调用。
+    """
+    player_prefer = player.field_maybe_none('prefer')
+    group_prefer = player.field_maybe_none('group_prefer')
+    context = dict(
+        DEFAULT_CONTEXT,
+        manager_id=player.field_maybe_none('matched_manager_id') or DEFAULT_CONTEXT['manager_id'],
+        manager_prefer=player.field_maybe_none('group_manager_prefer') or DEFAULT_CONTEXT['manager_prefer'],
+        team=player.field_maybe_none('group_team') or DEFAULT_CONTEXT['team'],
+        organization=player.field_maybe_none('group_organization') or DEFAULT_CONTEXT['organization'],
+        stated_amount=player.field_maybe_none('manager_stated_amount') or DEFAULT_CONTEXT['stated_amount'],
+        correct_amount=player.field_maybe_none('manager_correct_amount') or DEFAULT_CONTEXT['correct_amount'],
+        threshold_integer=player.field_maybe_none('manager_threshold_integer') or DEFAULT_CONTEXT['threshold_integer'],
+        player_prefer=player_prefer,
+        group_prefer=group_prefer,
+    )
+    if all([player_prefer, group_prefer, player.field_maybe_none('group_team'), player.field_maybe_none('group_organization')]):
+        context['answer_key'] = {
+            'choiceE': PAINTING_MAPPING.get(player_prefer),
+            'choiceM': PAINTING_MAPPING.get(group_prefer),
+            'choiceT': context['team'],
+            'choiceO': context['organization'],
+        }
+    player.participant.vars['manager_context'] = context
+
+
+def template_context(player: Player, *keys):
+    """The cached values for keys (see refresh_manager_context), for vars_for_template."""
+    context = player.participant.vars.get('manager_context', DEFAULT_CONTEXT)
+    return {key: context[key] for key in keys}
+
+
+def amount_label(value):
+    """Player fields store manager amounts as text; MISSING cells show as 'Not available'."""
+    return "Not available" if value == MISSING else str(value)
+
+
 # PAGES
 
 class Role(Page):
-    @staticmethod
-    def before_next_page(player: Player, timeout_happened=False):
-        """
-        从 participant.vars 中读取预分配的经理数据
-        不再进行动态分配，完全避免并发问题
-        """
-        assigned = player.participant.vars.get('assigned_manager')
-        
-        if not assigned:
-            print(f"❌ ERROR: Player {player.id_in_group} has no assigned manager")
-            player.matched_manager_id = "ERROR_NO_ASSIGNMENT"
-            return
-        
-        # 直接读取预分配的数据
-        player.matched_manager_id = assigned['id']
-        player.group_manager_id = assigned['id']
-        player.group_manager_prefer = assigned['prefer']
-        player.group_prefer = assigned['prefer']
-        player.group_team = assigned['team']
-        player.group_organization = assigned['organization']
-        
-        player.manager_stated_amount = assigned['stated_amount']
-        player.manager_correct_amount = assigned['correct_amount']
-        player.manager_threshold_integer = assigned['threshold_integer']
-        
-        player.manager_match_order = assigned['assignment_order']
-        player.manager_match_timestamp = assigned['assignment_timestamp']
-        
-        print(f"\n{'='*50}")
-        print(f"LOADING PRE-ASSIGNED MANAGER FOR PLAYER {player.id_in_group}")
-        print(f"{'='*50}")
-        print(f"Manager ID: {player.matched_manager_id}")
-        print(f"Manager Preference: {player.group_manager_prefer}")
-        print(f"Team: {player.group_team}")
-        print(f"Organization: {player.group_organization}")
-        print(f"Assignment Order: {player.manager_match_order}")
-        print(f"{'='*50}\n")
+    # 只读页面：两种模式下经理都在 Painting 提交时分配
+    pass
 
 
 class Painting(Page):
@@ -471,33 +1028,35 @@ class Painting(Page):
     
     @staticmethod
     def vars_for_template(player: Player):
-        return {
-            'manager_prefer': player.field_maybe_none('group_manager_prefer') or 'Not available',
-            'team': player.field_maybe_none('group_team') or 'Not assigned',
-            'organization': player.field_maybe_none('group_organization') or 'Not assigned'
-        }
+        return template_context(player, 'manager_prefer', 'team', 'organization')
     
     @staticmethod
     def before_next_page(player: Player, timeout_happened=False):
         """
-        员工选择后，记录配对类型
-        这里的计数更新仍有轻微竞态风险，但不影响核心分配逻辑
-        如需完全避免，可以在 Result 页面统一计算
+        员工选择后分配经理，并记录配对类型
+        计数在数据库中原子递增，并发提交不会丢失更新
         """
+        if player.field_maybe_none('matched_manager_id') is None:
+            assign_manager(player)
+        if player.field_maybe_none('group_manager_prefer') is None:
+            return
+        
         employee_prefer = player.prefer
         manager_prefer = player.group_manager_prefer
         
-        if employee_prefer == manager_prefer:
-            player.session.vars['same_pairs_count'] += 1
-            pair_type = "SAME"
-        else:
-            player.session.vars['different_pairs_count'] += 1
-            pair_type = "DIFFERENT"
+        pair_counter = SAME_PAIRS if employee_prefer == manager_prefer else DIFFERENT_PAIRS
+        increment_counter(player.subsession, pair_counter)
         
-        print(f"\n📊 PAIR TYPE RECORDED: {pair_type}")
-        print(f"   Employee: {employee_prefer}, Manager: {manager_prefer}")
-        print(f"   Total - Same: {player.session.vars['same_pairs_count']}, Different: {player.session.vars['different_pairs_count']}")
-        print(f"   Balance gap: {player.session.vars['same_pairs_count'] - player.session.vars['different_pairs_count']}\n")
+        # 计数只在调试时输出，生产环境不额外查询
+        log = player_logger(logger, player, 'Painting')
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug(
+                "Pair type recorded",
+                extra=dict(
+                    pair_type=pair_counter, employee=employee_prefer, manager_prefer=manager_prefer,
+                    total=get_counters(player.subsession)[pair_counter],
+                ),
+            )
 
 
 class Charity(Page):
@@ -507,40 +1066,25 @@ class Charity(Page):
 class Organization(Page):
     @staticmethod
     def vars_for_template(player: Player):
-        return {
-            'organization': player.field_maybe_none('group_organization') or 'Not assigned',
-            'team': player.field_maybe_none('group_team') or 'Not assigned'
-        }
+        return template_context(player, 'organization', 'team')
 
 
 class MatchingResult(Page):
     @staticmethod
     def vars_for_template(player: Player):
-        return {
-            'team': player.field_maybe_none('group_team') or 'Not assigned',
-            'organization': player.field_maybe_none('group_organization') or 'Not assigned',
-            'player_prefer': player.field_maybe_none('prefer'),
-            'group_prefer': player.field_maybe_none('group_prefer')
-        }
+        return template_context(player, 'team', 'organization', 'player_prefer', 'group_prefer')
 
 
 class BeforeIQTest(Page):
     @staticmethod
     def vars_for_template(player: Player):
-        return {
-            'team': player.field_maybe_none('group_team') or 'Not assigned',
-            'organization': player.field_maybe_none('group_organization') or 'Not assigned'
-        }
+        return template_context(player, 'team', 'organization')
 
 
 class MisreportingRule2(Page):
     @staticmethod
     def vars_for_template(player: Player):
-        return {
-            'team': player.field_maybe_none('group_team') or 'Not assigned',
-            'organization': player.field_maybe_none('group_organization') or 'Not assigned',
-            'threshold_integer': player.field_maybe_none('manager_threshold_integer') or '8'
-        }
+        return template_context(player, 'team', 'organization', 'threshold_integer')
 
 
 class Score(Page):
@@ -548,16 +1092,37 @@ class Score(Page):
     
     @staticmethod
     def vars_for_template(player: Player, timeout_happened=False):
-        stated_amount = player.field_maybe_none('manager_stated_amount') or 'Not available'
-        correct_amount = player.field_maybe_none('manager_correct_amount') or 'Not available'
-        
-        return {
-            'stated_amount': stated_amount,
-            'correct_amount': correct_amount,
-            'manager_id': player.field_maybe_none('matched_manager_id') or 'Not matched',
-            'team': player.field_maybe_none('group_team') or 'Not assigned',
-            'organization': player.field_maybe_none('group_organization') or 'Not assigned'
-        }
+        return template_context(player, 'stated_amount', 'correct_amount', 'manager_id', 'team', 'organization')
+
+
+UNDERSTANDING_LABELS = {
+    'choiceE': 'Question 1 (Your painting)',
+    'choiceM': 'Question 2 (Manager\'s painting)',
+    'choiceT': 'Question 3 (Team painting)',
+    'choiceO': 'Question 4 (Organization\'s charity)',
+}
+
+
+def record_understanding_answer(player: Player, answer_key, field, value):
+    """
+    检查一道理解题并记录；返回是否正确。
+    understanding_attempts = 1 + 单题答错次数的最大值（相当于整页提交的次数），
+    四题都答对时记录是否每题第一次就答对。
+    """
+    state = player.participant.vars.get('understanding', dict(wrong={}, correct=[]))
+    correct = value == answer_key[field]
+    wrong = dict(state['wrong'])
+    solved = [f for f in state['correct'] if f != field]
+    if correct:
+        solved.append(field)
+    else:
+        wrong[field] = wrong.get(field, 0) + 1
+    player.participant.vars['understanding'] = dict(wrong=wrong, correct=solved)
+
+    player.understanding_attempts = 1 + max(wrong.values(), default=0)
+    if len(solved) == len(answer_key):
+        player.understanding_first_try_correct = not wrong
+    return correct
 
 
 class Understanding(Page):
@@ -566,61 +1131,49 @@ class Understanding(Page):
 
     @staticmethod
     def vars_for_template(player: Player):
-        return {
-            'team': player.field_maybe_none('group_team') or 'Not assigned',
-            'organization': player.field_maybe_none('group_organization') or 'Not assigned'
-        }
+        return template_context(player, 'team', 'organization')
 
     @staticmethod
-    def error_message(player: Player, values):
-        if player.understanding_attempts is None:
-            player.understanding_attempts = 0
-        player.understanding_attempts += 1
-
-        painting_mapping = {'Left': 'Klee', 'Right': 'Kandinsky'}
-        
-        p_pref = player.field_maybe_none('prefer')
-        m_pref = player.field_maybe_none('group_prefer')
-        g_team = player.field_maybe_none('group_team')
-        g_org  = player.field_maybe_none('group_organization')
+    def live_method(player: Player, data):
+        # 每答一题就检查，不用提交整页
+        field, value = data.get('field'), data.get('value')
+        answer_key = player.participant.vars.get('manager_context', {}).get('answer_key')
+        if field not in UNDERSTANDING_LABELS or not answer_key:
+            return
+        correct = record_understanding_answer(player, answer_key, field, value)
+        return {player.id_in_group: dict(field=field, correct=correct)}
 
-        if not all([p_pref, m_pref, g_team, g_org]):
+    @staticmethod
+    def error_message(player: Player, values):
+        # 正确答案在绑定经理时已算好（见 refresh_manager_context）
+        answer_key = player.participant.vars.get('manager_context', {}).get('answer_key')
+        if not answer_key:
             return "Error: Missing group assignment data. Please refresh or contact support."
 
-        correct_answers = {
-            'choiceE': painting_mapping.get(p_pref),
-            'choiceM': painting_mapping.get(m_pref),
-            'choiceT': g_team,
-            'choiceO': g_org
-        }
-
-        field_labels = {
-            'choiceE': 'Question 1 (Your painting)',
-            'choiceM': 'Question 2 (Manager\'s painting)',
-            'choiceT': 'Question 3 (Team painting)',
-            'choiceO': 'Question 4 (Organization\'s charity)'
-        }
-
+        # 页面上已逐题检查过；提交时再核对一遍（也适用于没有 JavaScript 的浏览器和 bot），
+        # 已答对的题不重复计数
+        solved = player.participant.vars.get('understanding', {}).get('correct', [])
         errors = []
-        for field, correct_val in correct_answers.items():
-            if values.get(field) != correct_val:
-                errors.append(field_labels[field])
+        for field, label in UNDERSTANDING_LABELS.items():
+            if field in solved and values[field] == answer_key[field]:
+                continue
+            if not record_understanding_answer(player, answer_key, field, values[field]):
+                errors.append(label)
 
-        if not errors:
-            if player.understanding_attempts == 1:
-                player.understanding_first_try_correct = True
-            return None
-        else:
-            if player.understanding_attempts == 1:
-                player.understanding_first_try_correct = False
-                
+        if errors:
             error_html = '<strong>Some answers are incorrect:</strong><ul style="margin-top: 5px;">'
             for e in errors:
                 error_html += f'<li>{e}</li>'
             error_html += '</ul><em>Please review the instructions and correct your choices.</em>'
-            
+
             return error_html
 
+    @staticmethod
+    def before_next_page(player: Player, timeout_happened=False):
+        increment_counter(player.subsession, UNDERSTANDING_DONE)
+        if player.understanding_first_try_correct:
+            increment_counter(player.subsession, UNDERSTANDING_FIRST_TRY)
+
 
 class Audit(Page):
     form_model = 'player'
@@ -628,13 +1181,7 @@ class Audit(Page):
 
     @staticmethod
     def vars_for_template(player: Player):
-        return {
-            'stated_amount': player.field_maybe_none('manager_stated_amount') or 'Not available',
-            'correct_amount': player.field_maybe_none('manager_correct_amount') or 'Not available',
-            'manager_id': player.field_maybe_none('matched_manager_id') or 'Not matched',
-            'team': player.field_maybe_none('group_team') or 'Not assigned',
-            'organization': player.field_maybe_none('group_organization') or 'Not assigned'
-        }
+        return template_context(player, 'stated_amount', 'correct_amount', 'manager_id', 'team', 'organization')
 
     @staticmethod
     def before_next_page(player: Player, timeout_happened=False):
@@ -644,69 +1191,163 @@ class Audit(Page):
             player.report = True
         else:
             player.report = False
+        
+        increment_counter(player.subsession, AUDITS)
+        if player.report:
+            increment_counter(player.subsession, REPORTS)
+        
+        # 经理的结果已确定，租约不再回收
+        complete_lease(player)
 
 
-class Survey_m(Page):
+class Survey_c(Page):
     form_model = 'player'
-    form_fields = [f'SM{i}' for i in range(1, len(C.SURVEY_M_QUESTIONS) + 1)]
-    
+    form_fields = ['charity_1', 'charity_2']
+
     @staticmethod
     def vars_for_template(player: Player):
-        return {
-            'team': player.field_maybe_none('group_team') or 'Not assigned',
-            'organization': player.field_maybe_none('group_organization') or 'Not assigned',
-            'player_prefer': player.field_maybe_none('prefer'),
-            'group_prefer': player.field_maybe_none('group_prefer')
-        }
+        return template_context(player, 'team', 'organization')
 
-class Survey_o(Page):
-    form_model = 'player'
-    form_fields = [f'SO{i}' for i in range(1, len(C.SURVEY_O_QUESTIONS) + 1)]
+# 问卷的各部分（原来各是一个页面），按显示顺序；在浏览器里逐步显示，只提交一次
+QUESTIONNAIRE_SECTIONS = dict(
+    survey_m=[f'SM{i}' for i in range(1, len(C.SURVEY_M_QUESTIONS) + 1)],
+    survey_o=[f'SO{i}' for i in range(1, len(C.SURVEY_O_QUESTIONS) + 1)],
+    big5=[f'Q{i + 1}' for i in range(len(C.QUESTIONS))],
+    comparison=[f'Comp{i}' for i in range(1, len(C.COMPARISON_QUESTIONS) + 1)],
+    dictator=['dictator_keep'],
+    info=['age', 'gender', 'education', 'income', 'employment', 'occupation'],
+)
 
-    @staticmethod
-    def vars_for_template(player: Player):
-        
-        return {
-            'team': player.field_maybe_none('group_team') or 'Not assigned',
-            'organization': player.field_maybe_none('group_organization') or 'Not assigned'
-        }
 
-class Survey_c(Page):
+class Questionnaire(Page):
     form_model = 'player'
-    form_fields = ['charity_1', 'charity_2']
+    form_fields = [name for fields in QUESTIONNAIRE_SECTIONS.values() for name in fields]
 
     @staticmethod
     def vars_for_template(player: Player):
-        
-        return {
-            'team': player.field_maybe_none('group_team') or 'Not assigned',
-            'organization': player.field_maybe_none('group_organization') or 'Not assigned'
-        }
+        return dict(
+            template_context(player, 'team', 'organization', 'player_prefer', 'group_prefer'),
+            endowment=C.DICTATOR_ENDOWMENT,
+            **{f'{section}_fields': fields for section, fields in QUESTIONNAIRE_SECTIONS.items()},
+        )
 
-class Big5(Page):
-    form_model = 'player'
-    form_fields = [f'Q{i + 1}' for i in range(len(C.QUESTIONS))]
 
+def settle_session(session):
+    """
+    Settle every main player of the session who finished Audit and hasn't been
+    settled yet: store their manager's bonus and payment, and add them to the
+    managers' cross-session tallies. Employees only get the participation fee,
+    so their payoff stays 0. One query loads the players; the amounts are
+    computed column-wise (see settlement.py). Returns the newly settled
+    manager bonuses in PROLIFIC_CURRENCY as {prolific_id: amount}; the base
+    payment is the managers' study reward and is not included.
+    """
+    pool = session_pool(session)
+    if pool is None:
+        raise ValueError(f"Session {session.code} has no stored manager pool")
+
+    players = (
+        db.query(Player)
+        .filter(Player.session_id == session.id, Player.report.isnot(None), Player.settled_at.is_(None))
+        .options(joinedload(Player.participant))
+        .all()
+    )
+    matched = []
+    rows = array('l')
+    for player in players:
+        ref = player.participant.vars.get('manager_ref')
+        if ref is not None:
+            matched.append(player)
+            rows.append(ref // len(C.CHALLENGE_CHOICES))
+    bonus, payment = settle_amounts(
+        [pool.stated_amount[row] for row in rows],
+        [pool.threshold_integer[row] for row in rows],
+        [player.report for player in matched],
+    )
 
-class Comparison(Page):
-    form_model = 'player'
-    form_fields = [f'Comp{i}' for i in range(1, len(C.COMPARISON_QUESTIONS) + 1)]
+    now = time.time()
+    managers = defaultdict(float)
+    for player in players:
+        player.settled_at = now
+    for player, row, b, p in zip(matched, rows, bonus, payment):
+        player.manager_bonus = b
+        player.manager_payment = p
+        # 同一经理可能匹配多名员工（重复使用经理时），奖金累加；基本报酬不在其中
+        managers[pool.prolific_ids[row]] += to_prolific(b)
+    record_settlements(pool, rows, [player.report for player in matched], bonus)
+    logger.info(
+        "Session settled",
+        extra=dict(session=session.code, players=len(players), managers=len(managers), total=round(sum(managers.values()), 2)),
+    )
+    return dict(managers)
+
+
+EXPORT_HEADER = [
+    'session_code', 'participant_code', 'prolific_id', 'id_in_subsession',
+    'prefer', 'manager_id', 'manager_prefer', 'organization', 'pair_type',
+    'manager_stated_amount', 'manager_correct_amount', 'manager_threshold_integer', 'manager_misreported',
+    'understanding_attempts', 'understanding_first_try_correct',
+    'report_probability', 'report', 'manager_bonus', 'manager_payment',
+]
+
+
+def manager_columns(pool, ref, prefer):
+    """The manager_* export columns (manager_id to manager_misreported) for a manager_ref."""
+    if pool is None or ref is None:
+        return [''] * 8
+    row, organization_code = divmod(ref, len(C.CHALLENGE_CHOICES))
+    stated, correct = pool.stated_amount[row], pool.correct_amount[row]
+    manager_prefer = pool.prefer_label(row)
+    if prefer is None:
+        pair_type = ''
+    else:
+        pair_type = 'same' if prefer == manager_prefer else 'different'
+    return [
+        pool.ids[row],
+        manager_prefer,
+        C.CHALLENGE_CHOICES[organization_code],
+        pair_type,
+        '' if stated == MISSING else stated,
+        '' if correct == MISSING else correct,
+        pool.threshold_integer[row],
+        '' if MISSING in (stated, correct) else stated > correct,
+    ]
 
 
-class Dictator(Page):
-    form_model = 'player'
-    form_fields = ['dictator_keep']
-    
-    @staticmethod
-    def vars_for_template(player: Player):
-        return {
-            'endowment': C.DICTATOR_ENDOWMENT
-        }
+def export_amount(value):
+    """A currency field as a plain number (None if not set)."""
+    return None if value is None else float(value)
 
 
-class Info(Page):
-    form_model = 'player'
-    form_fields = ['age', 'gender', 'education', 'income', 'employment', 'occupation']
+def export_rows(players):
+    """
+    One row per player, joined against the cached manager pool (not the copied
+    text fields). A generator that keeps no per-row state, so it can be fed
+    from a streaming query (python -m main.export).
+    """
+    # 每个会话只查找一次创建会话时的经理池
+    pools = {}
+    for player in players:
+        participant = player.participant
+        session = participant.session
+        if session.code not in pools:
+            pools[session.code] = session_pool(session)
+        prefer = player.field_maybe_none('prefer')
+        yield [
+            session.code, participant.code, participant.vars.get('prolific_id', ''), player.id_in_subsession,
+            prefer, *manager_columns(pools[session.code], participant.vars.get('manager_ref'), prefer),
+            player.field_maybe_none('understanding_attempts'),
+            player.field_maybe_none('understanding_first_try_correct'),
+            player.field_maybe_none('report_probability'),
+            player.field_maybe_none('report'),
+            export_amount(player.field_maybe_none('manager_bonus')),
+            export_amount(player.field_maybe_none('manager_payment')),
+        ]
+
+
+def custom_export(players):
+    yield EXPORT_HEADER
+    yield from export_rows(players)
 
 
 class Result(Page):
@@ -715,32 +1356,20 @@ class Result(Page):
         # 核心修复：从 player.report 获取状态，而非 session.vars
         report_status = player.report 
         
-        try:
-            stated_amount = int(player.manager_stated_amount)
-        except (ValueError, TypeError):
-            stated_amount = 0
-        
-        # 这里的计算逻辑建议根据你的实验手册核对
-        if stated_amount > 8:
-            bonus_amount = min((stated_amount - 8) * 0.5, 2.0)
-        else:
-            bonus_amount = 0.0
-        
-        # 根据举报状态决定经理支付（此处逻辑仅供数据展示）
-        if report_status:
-            manager_total_payment = 0.67 
+        # 已结算时用存下的结果，否则按同样的规则现算
+        bonus_amount = player.field_maybe_none('manager_bonus')
+        if bonus_amount is not None:
+            bonus_amount = float(bonus_amount)
         else:
-            manager_total_payment = 0.67 + bonus_amount
+            manager = assigned_manager(player.participant)
+            bonus_amount = manager_bonus(manager.stated_amount, manager.threshold_integer, report_status) if manager else 0.0
+        manager_total_payment = BASE_PAYMENT + bonus_amount
         
         return {
             'report': report_status,
             'bonus_amount': f"{bonus_amount:.2f}",
             'manager_total_payment': f"{manager_total_payment:.2f}",
-            'manager_id': player.field_maybe_none('matched_manager_id') or 'Not matched',
-            'team': player.field_maybe_none('group_team') or 'Not assigned',
-            'organization': player.field_maybe_none('group_organization') or 'Not assigned',
-            'stated_amount': player.manager_stated_amount,
-            'correct_amount': player.manager_correct_amount,
+            **template_context(player, 'manager_id', 'team', 'organization', 'stated_amount', 'correct_amount'),
             'player_payoff': player.payoff
         }
 
@@ -757,11 +1386,14 @@ page_sequence = [
     MisreportingRule2,
     Score,
     Audit,
-    Survey_m,
-    Survey_o,
-    Big5, 
-    Comparison, 
-    Dictator, 
-    Info, 
+    Questionnaire,
     Result
-]
\ No newline at end of file
+]
+
+# 管理员报告：各页面人数和各页面方法的耗时
+track_pages(page_sequence, lambda player, name: increment_counter(player.subsession, name))
+instrument(__name__, page_sequence)
+# 每页在后台加载下一页的图片
+attach_prefetch(__name__, page_sequence)
+# 启动时编译模板、读取经理数据，第一个参与者不用等
+warm_up(__name__, page_sequence, lambda: load_manager_pool(C.MANAGER_DATA_PATH))
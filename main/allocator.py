@@ -0,0 +1,71 @@
+"""
+Online manager allocation.
+
+Instead of fixing a manager for every slot when the session is created,
+managers are drawn when an employee submits Painting:
+
+1. The pair type (same / different painting as the employee) is chosen to
+   keep the live same/different counters balanced.
+2. That fixes the manager's prefer, and the next manager is taken from a
+   per-session ordering of the Left or Right managers, least used (across
+   sessions) first.
+3. The organization comes from permuted blocks within each manager prefer,
+   so prefer x organization cells stay balanced however many people arrive.
+
+Everything here is derived from the session's seed, a snapshot of the
+cross-session usage ledger and a draw number, so the only shared state is the
+per-side draw counters (see Counter in __init__.py).
+"""
+import random
+from collections import OrderedDict
+
+# process cache: (pool digest, seed) -> (left rows, right rows), most recently used last
+_queues = OrderedDict()
+# 只保留最近用到的几个会话，长时间运行的服务器内存不会随会话数增长
+MAX_CACHED_SESSIONS = 16
+
+
+def least_used_first(rows, rng, usage=None):
+    """
+    Shuffle rows, then order them by how often each manager has been used in
+    earlier sessions (usage is indexed by pool row). Ties stay in random order.
+    """
+    rows = list(rows)
+    rng.shuffle(rows)
+    if usage is not None:
+        rows.sort(key=usage.__getitem__)
+    return rows
+
+
+def manager_queues(pool, seed, usage=None):
+    """The session's Left and Right manager rows, least used first."""
+    key = (pool.digest, seed)
+    if key in _queues:
+        _queues.move_to_end(key)
+    else:
+        rng = random.Random(seed)
+        _queues[key] = (
+            least_used_first(pool.left_indices, rng, usage),
+            least_used_first(pool.right_indices, rng, usage),
+        )
+        if len(_queues) > MAX_CACHED_SESSIONS:
+            _queues.popitem(last=False)
+    return _queues[key]
+
+
+def organization_for(seed, side, draw, num_organizations):
+    """
+    Organization code for the draw-th manager (0-based) taken from one prefer side.
+    Each block of num_organizations consecutive draws contains every organization once.
+    """
+    block, position = divmod(draw, num_organizations)
+    order = list(range(num_organizations))
+    random.Random(f'{seed}-{side}-{block}').shuffle(order)
+    return order[position]
+
+
+def choose_same_pair(same_pairs, different_pairs, rng=random):
+    """Whether the next employee should get a manager with the same painting."""
+    if same_pairs == different_pairs:
+        return rng.random() < 0.5
+    return same_pairs < different_pairs
@@ -0,0 +1,205 @@
+"""
+Manager assignment plans.
+
+A plan fixes, for every participant slot of a session, which manager (row of
+the manager pool) and which organization the slot gets. With
+manager_allocation='preallocate', slots are handed out in the order
+employees submit Painting. By default the plan is built from a per-session
+seed; for large room sessions it can be compiled ahead of time, audited, and
+memory-mapped instead:
+
+    python -m main.compile_plan --config your_experiment --slots 3000 --out plans/room.plan
+    python -m main.compile_plan --summary plans/room.plan
+
+and then set the session config's assignment_plan to plans/room.plan.
+
+File layout (little endian): header, organization labels, int32 manager row
+per slot (-1 = no manager left), int8 organization per slot. The header's
+flags record whether the plan was built with replacement, i.e. whether a
+manager may fill more than one slot.
+"""
+import mmap
+import random
+import struct
+from array import array
+
+from .allocator import least_used_first
+
+MAGIC = b'MAPL'
+VERSION = 2
+# magic, version, pool digest, number of slots, length of the labels block, flags
+HEADER = struct.Struct('<4sH32sIHB')
+FLAG_REPLACEMENT = 0x01
+LABEL_SEPARATOR = '\x1f'
+NO_MANAGER = -1
+
+
+class AssignmentPlan:
+    """Slot -> (manager row, organization) arrays, in memory or mapped from a plan file."""
+
+    def __init__(self, manager_index, organization, organizations, digest, replacement=False):
+        self.manager_index = manager_index
+        self.organization = organization
+        self.organizations = tuple(organizations)
+        self.digest = digest
+        self.replacement = bool(replacement)
+        self._mmap = None
+
+    def __len__(self):
+        return len(self.manager_index)
+
+    def close(self):
+        if self._mmap is not None:
+            # views into the map must be released before it can be closed
+            self.manager_index.release()
+            self.organization.release()
+            self._mmap.close()
+            self._mmap = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def build_plan(pool, num_slots, organizations, rng=random, usage=None, replacement=False):
+    """
+    Order Left and Right managers separately (least used first, see
+    allocator.least_used_first) and alternate between them, so that
+    consecutive slots get managers with different preferences.
+    Once one side runs out, the other side fills the remaining slots; when both
+    are used up, slots get NO_MANAGER, or with replacement both sides start over.
+    """
+    queues = (
+        least_used_first(pool.left_indices, rng, usage),
+        least_used_first(pool.right_indices, rng, usage),
+    )
+    positions = [0, 0]
+    manager_index = array('i')
+    organization = array('b')
+
+    for i in range(num_slots):
+        if replacement and len(pool) and all(positions[side] >= len(queues[side]) for side in (0, 1)):
+            positions = [0, 0]
+        # 交替分配，确保平衡：偶数位优先 Left，奇数位优先 Right
+        for side in ((0, 1) if i % 2 == 0 else (1, 0)):
+            if positions[side] < len(queues[side]):
+                manager_index.append(queues[side][positions[side]])
+                positions[side] += 1
+                break
+        else:
+            manager_index.append(NO_MANAGER)
+        organization.append(rng.randrange(len(organizations)))
+
+    return AssignmentPlan(manager_index, organization, organizations, pool.digest, replacement)
+
+
+def save_plan(path, plan):
+    labels = LABEL_SEPARATOR.join(plan.organizations).encode('utf-8')
+    flags = FLAG_REPLACEMENT if plan.replacement else 0
+    header = HEADER.pack(MAGIC, VERSION, bytes.fromhex(plan.digest), len(plan), len(labels), flags)
+    # pad so that the int32 block starts on a 4-byte boundary
+    padding = b'\0' * (-(len(header) + len(labels)) % 4)
+    with open(path, 'wb') as f:
+        f.write(header)
+        f.write(labels)
+        f.write(padding)
+        f.write(array('i', plan.manager_index).tobytes())
+        f.write(array('b', plan.organization).tobytes())
+
+
+def load_plan(path, pool, organizations=None):
+    """
+    Memory-map a compiled plan and validate it against the current manager pool
+    (and, if given, the expected organization labels).
+    Raises ValueError if the file is malformed or was compiled from a different input.csv.
+    """
+    with open(path, 'rb') as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        if len(mm) < HEADER.size:
+            raise ValueError(f"{path}: not an assignment plan")
+        magic, version, digest, num_slots, labels_len, flags = HEADER.unpack_from(mm, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path}: not an assignment plan (or unsupported version, recompile it)")
+        if digest.hex() != pool.digest:
+            raise ValueError(f"{path}: plan was compiled against a different input.csv")
+
+        labels_start = HEADER.size
+        index_start = labels_start + labels_len + (-(labels_start + labels_len) % 4)
+        org_start = index_start + 4 * num_slots
+        if len(mm) != org_start + num_slots:
+            raise ValueError(f"{path}: truncated or corrupt plan")
+
+        organizations = bytes(mm[labels_start:labels_start + labels_len]).decode('utf-8').split(LABEL_SEPARATOR)
+        view = memoryview(mm)
+        plan = AssignmentPlan(
+            view[index_start:org_start].cast('i'),
+            view[org_start:].cast('b'),
+            organizations,
+            pool.digest,
+            flags & FLAG_REPLACEMENT,
+        )
+        view.release()
+        plan._mmap = mm
+    except Exception:
+        mm.close()
+        raise
+
+    problems = validate_plan(plan, pool)
+    if organizations is not None and plan.organizations != tuple(organizations):
+        problems.append(f"plan organizations {plan.organizations} don't match {tuple(organizations)}")
+    if problems:
+        plan.close()
+        raise ValueError(f"{path}: " + '; '.join(problems))
+    return plan
+
+
+def validate_plan(plan, pool):
+    """
+    Problems with a plan as a list of messages (empty if it is usable).
+    A manager may fill more than one slot only in plans built with replacement.
+    """
+    problems = []
+    seen = set()
+    for slot, idx in enumerate(plan.manager_index):
+        if idx == NO_MANAGER:
+            continue
+        if not 0 <= idx < len(pool):
+            problems.append(f"slot {slot + 1} refers to manager row {idx}, pool has {len(pool)}")
+        elif idx in seen and not plan.replacement:
+            problems.append(f"manager {pool.ids[idx]} is assigned more than once")
+        seen.add(idx)
+    if any(not 0 <= org < len(plan.organizations) for org in plan.organization):
+        problems.append("organization code out of range")
+    return problems
+
+
+def summarize(plan, pool):
+    """Balance and shortage figures for a plan, for printing before launch."""
+    assigned = [idx for idx in plan.manager_index if idx != NO_MANAGER]
+    left = sum(1 for idx in assigned if pool.prefer[idx] == 0)
+    org_counts = [0] * len(plan.organizations)
+    for org in plan.organization:
+        org_counts[org] += 1
+    return {
+        'slots': len(plan),
+        'assigned': len(assigned),
+        'shortage': len(plan) - len(assigned),
+        'left': left,
+        'right': len(assigned) - left,
+        'organizations': dict(zip(plan.organizations, org_counts)),
+        'managers_in_pool': len(pool),
+        'replacement': plan.replacement,
+    }
+
+
+def print_summary(summary):
+    print(f"Slots: {summary['slots']}")
+    print(f"Managers in pool: {summary['managers_in_pool']}")
+    print(f"Replacement: {'yes' if summary['replacement'] else 'no'}")
+    print(f"Assigned: {summary['assigned']}  (Left: {summary['left']}, Right: {summary['right']})")
+    print(f"Shortage: {summary['shortage']}")
+    for label, count in summary['organizations'].items():
+        print(f"Organization {label}: {count}")
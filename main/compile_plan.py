@@ -0,0 +1,63 @@
+"""
+Compile and audit manager assignment plans, see main/assignment_plan.py.
+
+    python -m main.compile_plan --config your_experiment --slots 3000 --out plans/room.plan
+    python -m main.compile_plan --summary plans/room.plan
+"""
+import argparse
+import os
+import random
+import sys
+
+from . import C
+from .assignment_plan import build_plan, load_plan, print_summary, save_plan, summarize
+from .manager_pool import load_manager_pool
+
+
+def _session_config(name):
+    import settings
+
+    for config in settings.SESSION_CONFIGS:
+        if config['name'] == name:
+            return dict(settings.SESSION_CONFIG_DEFAULTS, **config)
+    sys.exit(f"No session config named {name!r} in settings.py")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m main.compile_plan', description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--csv', default=C.MANAGER_DATA_PATH, help='manager pool CSV (default: main/input.csv)')
+    parser.add_argument('--config', help='session config name; its num_demo_participants is the default --slots')
+    parser.add_argument('--slots', type=int, help='number of participant slots to plan')
+    parser.add_argument('--seed', type=int, help='random seed, for reproducible plans')
+    parser.add_argument('--replacement', action='store_true',
+                        help='reuse managers once the pool is used up instead of leaving slots unassigned')
+    parser.add_argument('--out', help='where to write the compiled plan')
+    parser.add_argument('--summary', metavar='PLAN', help='validate and summarize an existing plan')
+    args = parser.parse_args(argv)
+
+    pool = load_manager_pool(args.csv)
+
+    if args.summary:
+        try:
+            with load_plan(args.summary, pool) as plan:
+                print_summary(summarize(plan, pool))
+        except ValueError as exc:
+            sys.exit(f"Invalid plan: {exc}")
+        return
+
+    num_slots = args.slots
+    if num_slots is None and args.config:
+        num_slots = _session_config(args.config)['num_demo_participants']
+    if not num_slots or not args.out:
+        parser.error('--out and either --slots or --config are required')
+
+    plan = build_plan(pool, num_slots, C.CHALLENGE_CHOICES, random.Random(args.seed), replacement=args.replacement)
+    os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+    save_plan(args.out, plan)
+    print(f"Wrote {args.out}")
+    print_summary(summarize(plan, pool))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+"""
+Stream the main export (custom_export in main/__init__.py) straight to a CSV file.
+
+    python -m main.export --out main.csv
+    python -m main.export --session SESSION_CODE --out main.csv
+
+oTree's data export page loads every player before writing the first row.
+This reads the players BATCH_SIZE at a time, in id order, and writes each
+row as it goes, so memory use stays the same however large the session is.
+It uses the same database as the server (DATABASE_URL, or db.sqlite3 when
+unset).
+"""
+import argparse
+import csv
+import sys
+
+BATCH_SIZE = 500
+
+
+def player_batches(session=None, batch_size=BATCH_SIZE):
+    """Lists of main players (with their participant and session loaded), one per query."""
+    from otree.database import db
+    from sqlalchemy.orm import joinedload
+
+    from . import Player
+
+    session_id = session.id if session is not None else None
+    last_id = 0
+    while True:
+        query = db.query(Player).filter(Player.id > last_id)
+        if session_id is not None:
+            query = query.filter(Player.session_id == session_id)
+        batch = (
+            query.options(joinedload(Player.participant), joinedload(Player.session))
+            .order_by(Player.id)
+            .limit(batch_size)
+            .all()
+        )
+        if not batch:
+            return
+        yield batch
+        last_id = batch[-1].id
+        # 只读：丢弃这批对象（读取 participant.vars 会把参与者标记为已修改），内存不随人数增长
+        db.rollback()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m main.export', description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--out', required=True, help='CSV file to write')
+    parser.add_argument('--session', help='only export this session (code)')
+    args = parser.parse_args(argv)
+
+    from otree.database import session_scope
+    from otree.main import setup
+    from otree.models import Session
+
+    setup()
+    from . import custom_export
+
+    with session_scope():
+        session = None
+        if args.session:
+            session = Session.objects_filter(code=args.session).first()
+            if session is None:
+                sys.exit(f"No session with code {args.session!r}")
+        with open(args.out, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            players = (player for batch in player_batches(session) for player in batch)
+            rows = custom_export(players)
+            writer.writerow(next(rows))
+            count = 0
+            for row in rows:
+                writer.writerow(row)
+                count += 1
+    print(f"Wrote {args.out}: {count} players")
+
+
+if __name__ == '__main__':
+    main()
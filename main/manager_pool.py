@@ -0,0 +1,183 @@
+"""
+Manager pool loaded from input.csv.
+
+The CSV is an oTree export of the manager sessions (73 columns). Allocation
+only needs a handful of them, so we keep those as typed, array-backed columns
+and cache the parsed pool per process. The cache is keyed by path and checked
+against mtime and a content hash, so editing input.csv on a running server is
+picked up on the next session without re-parsing an unchanged file.
+dump_manager_pool() writes just those columns back out, so a session can
+keep the version it was created with (see session_pool in __init__.py).
+"""
+import csv
+import hashlib
+import io
+import os
+from array import array
+from collections import namedtuple
+
+PREFER_CHOICES = ('Left', 'Right')
+PAINTING_MAPPING = {'Left': 'Klee', 'Right': 'Kandinsky'}
+
+REQUIRED_COLUMNS = ['participantid_in_session', 'main1playerprefer']
+# the columns the pool keeps, in dump_manager_pool's order
+POOL_COLUMNS = REQUIRED_COLUMNS + [
+    'main1playerstated_amount',
+    'main1playerbriefing_correct_amou',
+    'main1playerthreshold_integer',
+    'participantprolific_id',
+]
+
+# stored in integer columns when the CSV cell is missing or not a number
+MISSING = -1
+DEFAULT_THRESHOLD = 8
+
+ManagerRecord = namedtuple(
+    'ManagerRecord', ['id', 'prefer', 'team', 'stated_amount', 'correct_amount', 'threshold_integer']
+)
+
+
+class ManagerPool:
+    """
+    Column store for the managers in input.csv.
+    Row i describes one manager; prefer is stored as an index into PREFER_CHOICES.
+    """
+
+    def __init__(self, path, digest, ids, prefer, stated_amount, correct_amount, threshold_integer, prolific_ids=None):
+        self.path = path
+        self.digest = digest
+        self.ids = ids
+        self.prefer = prefer
+        self.stated_amount = stated_amount
+        self.correct_amount = correct_amount
+        self.threshold_integer = threshold_integer
+        # 经理在 Prolific 上的 ID，用于发放报酬（CSV 中没有时为空字符串）
+        self.prolific_ids = prolific_ids if prolific_ids is not None else [''] * len(ids)
+
+        self.left_indices = [i for i, p in enumerate(prefer) if p == 0]
+        self.right_indices = [i for i, p in enumerate(prefer) if p == 1]
+        self._index_by_id = {manager_id: i for i, manager_id in enumerate(ids)}
+
+    def __len__(self):
+        return len(self.ids)
+
+    def index_of(self, manager_id):
+        """Row index of a manager ID (int or str), or None if unknown."""
+        try:
+            return self._index_by_id.get(int(manager_id))
+        except (TypeError, ValueError):
+            return None
+
+    def prefer_label(self, i):
+        return PREFER_CHOICES[self.prefer[i]]
+
+    def team(self, i):
+        return PAINTING_MAPPING[self.prefer_label(i)]
+
+    def record(self, i):
+        return ManagerRecord(
+            self.ids[i],
+            self.prefer_label(i),
+            self.team(i),
+            self.stated_amount[i],
+            self.correct_amount[i],
+            self.threshold_integer[i],
+        )
+
+
+def _to_int(value, default=MISSING):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return default
+
+
+def parse_manager_pool(raw, path='', digest=''):
+    """Build a ManagerPool from the raw bytes of input.csv."""
+    reader = csv.reader(io.StringIO(raw.decode('utf-8-sig')))
+    header = next(reader, [])
+    column_indices = {name: idx for idx, name in enumerate(header)}
+
+    missing = [name for name in REQUIRED_COLUMNS if name not in column_indices]
+    if missing:
+        raise ValueError(f"Required columns not found in {path or 'CSV'}: {missing}")
+
+    id_column = column_indices['participantid_in_session']
+    prefer_column = column_indices['main1playerprefer']
+    stated_column, correct_column, threshold_column, prolific_column = (
+        column_indices.get(name, -1) for name in POOL_COLUMNS[2:]
+    )
+
+    ids = array('l')
+    prefer = array('b')
+    stated_amount = array('h')
+    correct_amount = array('h')
+    threshold_integer = array('h')
+    prolific_ids = []
+
+    def get_value(row, col_idx):
+        if col_idx != -1 and col_idx < len(row):
+            return row[col_idx]
+        return None
+
+    for row in reader:
+        if not row:
+            continue
+        manager_prefer = row[prefer_column]
+        if manager_prefer not in PREFER_CHOICES:
+            # managers without a painting choice can't be allocated
+            continue
+        ids.append(int(row[id_column]))
+        prefer.append(PREFER_CHOICES.index(manager_prefer))
+        stated_amount.append(_to_int(get_value(row, stated_column)))
+        correct_amount.append(_to_int(get_value(row, correct_column)))
+        threshold_integer.append(_to_int(get_value(row, threshold_column), DEFAULT_THRESHOLD))
+        prolific_ids.append(get_value(row, prolific_column) or '')
+
+    return ManagerPool(path, digest, ids, prefer, stated_amount, correct_amount, threshold_integer, prolific_ids)
+
+
+def dump_manager_pool(pool):
+    """The pool as a CSV with only POOL_COLUMNS; parse_manager_pool reads it back unchanged."""
+    f = io.StringIO()
+    writer = csv.writer(f)
+    writer.writerow(POOL_COLUMNS)
+    for i in range(len(pool)):
+        writer.writerow([
+            pool.ids[i],
+            pool.prefer_label(i),
+            pool.stated_amount[i],
+            pool.correct_amount[i],
+            pool.threshold_integer[i],
+            pool.prolific_ids[i],
+        ])
+    return f.getvalue()
+
+
+# path -> (mtime_ns, pool)
+_cache = {}
+
+
+def load_manager_pool(path):
+    """
+    Return the ManagerPool for path, parsing the file at most once per change.
+    Raises OSError if the file doesn't exist and ValueError if it lacks required columns.
+    """
+    path = os.path.abspath(path)
+    mtime_ns = os.stat(path).st_mtime_ns
+
+    cached = _cache.get(path)
+    if cached and cached[0] == mtime_ns:
+        return cached[1]
+
+    with open(path, 'rb') as f:
+        raw = f.read()
+    digest = hashlib.sha256(raw).hexdigest()
+
+    if cached and cached[1].digest == digest:
+        # touched but not modified
+        pool = cached[1]
+    else:
+        pool = parse_manager_pool(raw, path, digest)
+    _cache[path] = (mtime_ns, pool)
+    return pool
@@ -0,0 +1,84 @@
+"""
+Settle a session's manager bonuses and write a Prolific bulk bonus file, see main/settlement.py.
+
+    python -m main.settle SESSION_CODE --out payments/
+    python -m main.settle --manager 17               # one manager, over all sessions
+    python -m main.settle --tally managers.csv       # every manager, over all sessions
+
+Employees get only the participation fee, and the managers' base payment
+is their study reward, so the bonus file lists only the managers' bonuses,
+in the Prolific currency (GBP). Players are settled once: running it again
+only settles (and lists) the players who finished Audit since the previous
+run, so each file it writes can be uploaded to Prolific as it is.
+Settling also adds to each manager's cross-session tally (ManagerTally),
+which --manager and --tally read without going through any players. It
+uses the same database as the server (DATABASE_URL, or db.sqlite3 when
+unset).
+"""
+import argparse
+import csv
+import os
+import sys
+import time
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m main.settle', description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('session_code', nargs='?', help='code of the session to settle')
+    parser.add_argument('--out', default='.', help='directory for the bonus file (default: current directory)')
+    parser.add_argument('--manager', type=int, help='show the tally of one manager (participantid_in_session)')
+    parser.add_argument('--tally', metavar='CSV', help='export the tally of every manager')
+    args = parser.parse_args(argv)
+    if not (args.session_code or args.manager is not None or args.tally):
+        parser.error('give a session code, --manager or --tally')
+
+    from otree.database import session_scope
+    from otree.main import setup
+    from otree.models import Session
+
+    setup()
+    from . import manager_tally, manager_tally_rows, settle_session
+    from .settlement import PROLIFIC_CURRENCY, write_bulk_bonus
+
+    with session_scope():
+        if args.session_code:
+            session = Session.objects_filter(code=args.session_code).first()
+            if session is None:
+                sys.exit(f"No session with code {args.session_code!r}")
+            try:
+                managers = settle_session(session)
+            except ValueError as exc:
+                sys.exit(str(exc))
+
+            print("Employees get only the participation fee; there is no bonus file for them")
+            paid = sum(1 for amount in managers.values() if round(amount, 2) > 0)
+            if not managers:
+                print("No players finished Audit since the last settlement")
+            elif not paid:
+                print(f"No bonuses to pay for {len(managers)} managers")
+            else:
+                os.makedirs(args.out, exist_ok=True)
+                # 文件名带时间，多次结算不会覆盖之前的文件
+                stamp = time.strftime('%Y%m%d-%H%M%S')
+                path = os.path.join(args.out, f'{args.session_code}-managers-{stamp}.csv')
+                write_bulk_bonus(path, managers)
+                print(f"Wrote {path}: {paid} managers, {sum(managers.values()):.2f} {PROLIFIC_CURRENCY} in total")
+
+        if args.manager is not None:
+            print(manager_tally(args.manager) or f"Manager {args.manager} has no settled matches")
+
+        if args.tally:
+            rows = manager_tally_rows()
+            with open(args.tally, 'w', newline='') as f:
+                writer = csv.writer(f)
+                writer.writerow(next(rows))
+                count = 0
+                for row in rows:
+                    writer.writerow(row)
+                    count += 1
+            print(f"Wrote {args.tally}: {count} managers")
+
+
+if __name__ == '__main__':
+    main()
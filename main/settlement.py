@@ -0,0 +1,61 @@
+"""
+Payment rules and the Prolific bulk bonus files.
+
+A manager receives BASE_PAYMENT plus BONUS_PER_POINT for each point they
+stated above their threshold, at most MAX_BONUS; the bonus is forfeited
+when their employee's report succeeds. Employees only get the participation
+fee paid through Prolific, so there is no employee bonus or bonus file.
+Amounts are in the session's real-world currency (USD, see settings.py).
+
+The base payment is the managers' Prolific study reward, already paid for
+their own session, so the bulk bonus file lists only the bonuses,
+converted to the Prolific currency (GBP) at the rate the instructions use
+("£1.5 ($2)").
+
+settle() applies the rules to whole columns (stated amounts, thresholds,
+report flags) in one pass. settle_session() in __init__.py reads the
+columns for a session with one query and stores the results on the
+players; python -m main.settle runs it and writes the managers' bonus file.
+"""
+from array import array
+
+BASE_PAYMENT = 0.67
+BONUS_PER_POINT = 0.5
+MAX_BONUS = 2.0
+PROLIFIC_CURRENCY = 'GBP'
+# 说明中的换算：$2 = £1.5
+PROLIFIC_PER_USD = 0.75
+
+
+def to_prolific(amount):
+    """A USD amount in the Prolific currency."""
+    return amount * PROLIFIC_PER_USD
+
+
+def manager_bonus(stated_amount, threshold, report):
+    """The bonus for one manager; a missing stated amount (-1) earns nothing."""
+    if report:
+        return 0.0
+    return min(max(stated_amount - threshold, 0) * BONUS_PER_POINT, MAX_BONUS)
+
+
+def settle(stated_amount, threshold, report):
+    """
+    Manager bonuses and total payments for equal-length columns of stated
+    amounts, thresholds and report flags, as two array('d').
+    """
+    bonus = array('d', map(manager_bonus, stated_amount, threshold, report))
+    payment = array('d', [BASE_PAYMENT + b for b in bonus])
+    return bonus, payment
+
+
+def write_bulk_bonus(path, amounts):
+    """
+    Write {prolific_id: amount} (in PROLIFIC_CURRENCY) in Prolific's bulk
+    bonus format, one "ID,amount" line each. IDs without an amount to pay
+    are left out.
+    """
+    with open(path, 'w', newline='') as f:
+        for prolific_id, amount in amounts.items():
+            if prolific_id and round(amount, 2) > 0:
+                f.write(f'{prolific_id},{amount:.2f}\n')
@@ -0,0 +1,116 @@
+"""
+Columnar export of the Questionnaire answers (Parquet or Arrow IPC).
+
+    python -m main.survey_export --out survey.parquet
+    python -m main.survey_export --out survey.arrow --session SESSION_CODE
+
+The 1-5 scales (SM, SO, Q and Comp) are stored as int8 and the categorical
+demographics as dictionary columns whose dictionary is the field's
+C.*_CHOICES list, so every file has the same category codes whatever
+answers it contains. Players are read in batches (see main/export.py), each
+written as one record batch. Needs pyarrow, which the server does
+not: pip install pyarrow.
+"""
+import argparse
+import sys
+
+
+def survey_schema(pa, sections, categories):
+    """The Arrow schema: participant identifiers, then the Questionnaire fields in page order."""
+    fields = [
+        pa.field('session_code', pa.dictionary(pa.int32(), pa.string())),
+        pa.field('participant_code', pa.string()),
+        pa.field('prolific_id', pa.string()),
+    ]
+    for section, names in sections.items():
+        for name in names:
+            if name in categories:
+                type_ = pa.dictionary(pa.int8(), pa.string())
+            elif name == 'dictator_keep':
+                type_ = pa.float32()
+            else:
+                # 1-5 量表和年龄
+                type_ = pa.int8()
+            fields.append(pa.field(name, type_))
+    return pa.schema(fields)
+
+
+def record_batch(pa, schema, players, categories):
+    columns = {field.name: [] for field in schema}
+    survey_fields = schema.names[3:]
+    for player in players:
+        participant = player.participant
+        columns['session_code'].append(participant.session.code)
+        columns['participant_code'].append(participant.code)
+        columns['prolific_id'].append(participant.vars.get('prolific_id'))
+        for name in survey_fields:
+            columns[name].append(player.field_maybe_none(name))
+
+    arrays = []
+    for field in schema:
+        values = columns[field.name]
+        if field.name in categories:
+            # 固定的类别表：编码与选项顺序一致
+            choices = categories[field.name]
+            codes = pa.array([None if value is None else choices.index(value) for value in values], pa.int8())
+            arrays.append(pa.DictionaryArray.from_arrays(codes, pa.array(choices, pa.string())))
+        elif field.name == 'session_code':
+            arrays.append(pa.array(values, pa.string()).dictionary_encode())
+        elif field.name == 'dictator_keep':
+            arrays.append(pa.array([None if value is None else float(value) for value in values], field.type))
+        else:
+            arrays.append(pa.array(values, field.type))
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m main.survey_export', description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--out', required=True, help='file to write; .parquet for Parquet, otherwise Arrow IPC')
+    parser.add_argument('--session', help='only export this session (code)')
+    args = parser.parse_args(argv)
+
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        sys.exit('The survey export needs pyarrow: pip install pyarrow')
+
+    from otree.database import session_scope
+    from otree.main import setup
+    from otree.models import Session
+
+    setup()
+    from . import C, QUESTIONNAIRE_SECTIONS
+    from .export import player_batches
+
+    categories = dict(
+        gender=C.GENDER_CHOICES,
+        education=C.EDUCATION_CHOICES,
+        income=C.INCOME_CHOICES,
+        employment=C.EMPLOYMENT_CHOICES,
+        occupation=C.OCCUPATION_CHOICES,
+    )
+    schema = survey_schema(pa, QUESTIONNAIRE_SECTIONS, categories)
+
+    with session_scope():
+        session = None
+        if args.session:
+            session = Session.objects_filter(code=args.session).first()
+            if session is None:
+                sys.exit(f"No session with code {args.session!r}")
+
+        if args.out.endswith('.parquet'):
+            writer = pq.ParquetWriter(args.out, schema, compression='zstd')
+        else:
+            writer = pa.ipc.new_file(args.out, schema)
+        count = 0
+        with writer:
+            for batch in player_batches(session):
+                writer.write_batch(record_batch(pa, schema, batch, categories))
+                count += len(batch)
+    print(f"Wrote {args.out}: {count} players")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+from otree.api import Currency as c, currency_range, expect, Bot, Submission, SubmissionMustFail
+from . import *
+from pre.tests import CASES, REACHES_MAIN
+
+# understanding_retry 提交一次错误答案；pass_third 在页面上逐题作答时答错一次
+UNDERSTANDING_RETRY_CASES = ['understanding_retry', 'pass_third']
+
+
+def understanding_answers(p):
+    return dict(
+        choiceE=PAINTING_MAPPING['Left'],
+        choiceM=PAINTING_MAPPING[p.group_prefer],
+        choiceT=p.group_team,
+        choiceO=p.group_organization,
+    )
+
+
+def wrong_organization(p):
+    return [org for org in C.CHALLENGE_CHOICES if org != p.group_organization][0]
+
+
+def call_live_method(method, group, case, page_class, **kwargs):
+    # understanding_retry 只走整页提交的检查
+    if page_class is not Understanding or case == 'understanding_retry':
+        return
+    # main 每组只有一人
+    p = group.get_players()[0]
+    if case == 'pass_third':
+        expect(method(1, dict(field='choiceO', value=wrong_organization(p))), {1: dict(field='choiceO', correct=False)})
+    for field, value in understanding_answers(p).items():
+        expect(method(1, dict(field=field, value=value)), {1: dict(field=field, correct=True)})
+    expect(p.understanding_first_try_correct, case != 'pass_third')
+
+
+
+class PlayerBot(Bot):
+    cases = CASES
+
+    def play_round(self):
+        if self.case not in REACHES_MAIN:
+            return
+
+        yield Role
+        yield Painting, dict(prefer='Left')
+
+        p = self.player
+        expect(p.matched_manager_id, '!=', 'ERROR_NO_ASSIGNMENT')
+        expect(p.group_prefer, 'in', C.PREFER_CHOICES)
+        expect(p.group_organization, 'in', C.CHALLENGE_CHOICES)
+
+        yield MatchingResult
+        yield Charity
+        yield Survey_c, dict(charity_1='NRA', charity_2='NRA')
+        yield Organization
+
+        answers = understanding_answers(p)
+        if self.case == 'understanding_retry':
+            yield SubmissionMustFail(Understanding, dict(answers, choiceO=wrong_organization(p)))
+        yield Understanding, answers
+
+        p = self.player
+        if self.case in UNDERSTANDING_RETRY_CASES:
+            expect(p.understanding_attempts, 2)
+            expect(p.understanding_first_try_correct, False)
+        else:
+            expect(p.understanding_attempts, 1)
+            expect(p.understanding_first_try_correct, True)
+
+        yield BeforeIQTest
+        yield MisreportingRule2
+        yield Score
+        yield Audit, dict(report_probability=50)
+        answers = {name: 3 for name in Questionnaire.form_fields}
+        answers.update(
+            dictator_keep=5,
+            age=30,
+            gender='Male',
+            education='Some College',
+            income='Prefer not to say',
+            employment='Student',
+            occupation='Other',
+        )
+        if self.case == 'understanding_retry':
+            # 服务器端仍按字段的 min/max 验证
+            yield SubmissionMustFail(Questionnaire, dict(answers, age=17))
+        yield Questionnaire, answers
+
+        p = self.player
+        expect(p.Q12, 3)
+        expect(p.dictator_keep, 5)
+        yield Result
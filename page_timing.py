@@ -0,0 +1,84 @@
+"""
+Timing of page handlers, for the admin report.
+
+instrument(app_name, page_sequence) wraps the handlers each page defines
+(vars_for_template, is_displayed, error_message, before_next_page,
+app_after_this_page, live_method). Each call's duration goes into a
+fixed-size ring buffer per page and handler, so memory use stays constant
+however long the session runs. timing_rows() summarizes the buffers for vars_for_admin_report.
+
+Figures are per server process. In production the pages are served by a
+single process (prodserver1of2), so the report covers all participants.
+"""
+import functools
+import time
+from array import array
+
+HOOKS = (
+    'vars_for_template', 'is_displayed', 'error_message', 'before_next_page', 'app_after_this_page', 'live_method',
+)
+# 每个页面/方法保留最近的调用次数
+BUFFER_SIZE = 1000
+
+
+class RingBuffer:
+    """The last `size` durations (seconds), plus the total number of calls."""
+
+    def __init__(self, size=BUFFER_SIZE):
+        self._values = array('d', bytes(8 * size))
+        self.calls = 0
+
+    def add(self, value):
+        self._values[self.calls % len(self._values)] = value
+        self.calls += 1
+
+    def values(self):
+        return self._values[:min(self.calls, len(self._values))]
+
+
+# (app name, page name, hook) -> RingBuffer
+_buffers = {}
+
+
+def _timed(fn, buffer):
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            buffer.add(time.perf_counter() - start)
+
+    return wrapper
+
+
+def instrument(app_name, page_sequence):
+    for page in page_sequence:
+        for hook in HOOKS:
+            # 只包装页面自己定义的方法，继承的默认实现不计时
+            method = page.__dict__.get(hook)
+            if isinstance(method, staticmethod):
+                buffer = _buffers.setdefault((app_name, page.__name__, hook), RingBuffer())
+                setattr(page, hook, staticmethod(_timed(method.__func__, buffer)))
+
+
+def _percentile(values, fraction):
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def timing_rows(app_name):
+    """One row per page handler that has been called, in page order, with durations in ms."""
+    rows = []
+    for (app, page, hook), buffer in _buffers.items():
+        if app != app_name or not buffer.calls:
+            continue
+        values = sorted(buffer.values())
+        rows.append(dict(
+            page=page,
+            hook=hook,
+            calls=buffer.calls,
+            p50_ms=round(_percentile(values, 0.5) * 1000, 2),
+            p95_ms=round(_percentile(values, 0.95) * 1000, 2),
+            max_ms=round(values[-1] * 1000, 2),
+        ))
+    return rows
@@ -1,15 +1,25 @@
 import random
+from functools import partial
 
 from otree.api import *
 
+import counters
+from dashboard import page_counter_names, page_rows, rate, track_pages
+from experiment_log import get_logger, player_logger
+from page_timing import instrument, timing_rows
+from template_warmup import warm_up
+
 doc = """
 Your app description
 """
 
+logger = get_logger('pre')
+
 
 class C(BaseConstants):
     NAME_IN_URL = 'pre'
-    PLAYERS_PER_GROUP = None
+    # 每人单独一组：oTree 每次回复 live_method 消息都会查询整组的玩家
+    PLAYERS_PER_GROUP = 1
     NUM_ROUNDS = 1
     ATTENTION_CHECK_NUM = random.randint(0, 100)
     ATTENTION_CHECK_NUM2 = random.randint(0, 100)
@@ -22,15 +32,53 @@ def creating_session(subsession):
             player.attention_check_num = random.randint(0, 100)
             player.attention_check_num2 = random.randint(0, 100)
             player.attention_check_num3 = random.randint(0, 100)
+        counters.create_counters(Counter, subsession, FUNNEL_COUNTERS + page_counter_names(page_sequence))
 
 class Subsession(BaseSubsession):
     pass
 
 
+def vars_for_admin_report(subsession: Subsession):
+    counts = get_counters(subsession)
+    consented = counts.get(CONSENTED, 0)
+    return dict(
+        page_timings=timing_rows(__name__),
+        pages=page_rows(page_sequence, counts),
+        funnel=[
+            dict(step='Consented', count=consented, rate=''),
+            dict(step='Declined consent', count=counts.get(DECLINED, 0), rate=''),
+        ] + [
+            dict(step=f'Passed attention check {i + 1}', count=counts.get(name, 0), rate=rate(counts.get(name, 0), consented))
+            for i, name in enumerate(PASSED_CHECK)
+        ] + [
+            dict(step='Failed all attention checks', count=counts.get(FAILED_CHECKS, 0), rate=rate(counts.get(FAILED_CHECKS, 0), consented)),
+        ],
+    )
+
+
 class Group(BaseGroup):
     pass
 
 
+class Counter(ExtraModel):
+    """注意力检查的人数统计，页面提交时原子递增（管理员报告用，见 counters.py）"""
+    subsession = models.Link(Subsession)
+    name = models.StringField()
+    value = models.IntegerField(initial=0)
+
+
+counters.index_counters(Counter)
+increment_counter = partial(counters.increment_counter, Counter)
+get_counters = partial(counters.get_counters, Counter)
+
+
+CONSENTED = 'consented'
+DECLINED = 'declined'
+PASSED_CHECK = ['passed_check_1', 'passed_check_2', 'passed_check_3']
+FAILED_CHECKS = 'failed_checks'
+FUNNEL_COUNTERS = [CONSENTED, DECLINED, FAILED_CHECKS] + PASSED_CHECK
+
+
 class Player(BasePlayer):
     consent = models.BooleanField()
 
@@ -49,6 +97,56 @@ class Player(BasePlayer):
     attention_check3 = models.IntegerField(
         label='What number were you asked to remember?'
     )
+    # AttentionCheck 页面的进度，见 attention_state
+    attention_check_stage = models.StringField(initial='remember')
+
+
+REMEMBER = 'remember'
+RECALL = 'recall'
+FEEDBACK = 'feedback'
+PASSED = 'passed'
+FAILED = 'failed'
+ANSWER_FIELDS = ['attention_check', 'attention_check2', 'attention_check3']
+
+
+def attention_numbers(player: Player):
+    return [player.attention_check_num, player.attention_check_num2, player.attention_check_num3]
+
+
+def attention_answers(player: Player):
+    return [player.field_maybe_none(name) for name in ANSWER_FIELDS if player.field_maybe_none(name) is not None]
+
+
+def attention_state(player: Player):
+    """What the AttentionCheck page shows at the player's current stage"""
+    stage = player.attention_check_stage
+    answered = len(attention_answers(player))
+    if stage in (REMEMBER, RECALL):
+        state = dict(stage=stage, trial=answered + 1)
+        if stage == REMEMBER:
+            state['number'] = attention_numbers(player)[answered]
+    else:
+        state = dict(stage=stage, trial=answered)
+        if stage != PASSED:
+            state['correct'] = attention_numbers(player)[answered - 1]
+            state['remaining'] = len(ANSWER_FIELDS) - answered
+    return state
+
+
+def record_attention_answer(player: Player, answer):
+    trial = len(attention_answers(player))
+    setattr(player, ANSWER_FIELDS[trial], answer)
+    if answer == attention_numbers(player)[trial]:
+        player.attention_check_stage = PASSED
+        increment_counter(player.subsession, PASSED_CHECK[trial])
+    elif trial + 1 == len(ANSWER_FIELDS):
+        player.attention_check_stage = FAILED
+        increment_counter(player.subsession, FAILED_CHECKS)
+    else:
+        player.attention_check_stage = FEEDBACK
+    player_logger(logger, player, 'AttentionCheck').debug(
+        "attention check answered", extra=dict(trial=trial + 1, stage=player.attention_check_stage)
+    )
 
 
 # PAGES
@@ -59,13 +157,14 @@ class Preview(Page):
     @staticmethod
     def before_next_page(player: Player, timeout_happened):
         participant = player.participant
+        increment_counter(player.subsession, CONSENTED if player.consent else DECLINED)
         
         # 从 URL 参数获取 Prolific ID 并保存
         if participant.label:
             participant.prolific_id = participant.label
-            print(f"DEBUG: Prolific ID saved: {participant.prolific_id}")
+            player_logger(logger, player, 'Preview').debug("Prolific ID saved", extra=dict(prolific_id=participant.prolific_id))
         else:
-            print("DEBUG: No Participant Label found in URL.")
+            player_logger(logger, player, 'Preview').debug("No participant label found in URL")
 
     @staticmethod
     def app_after_this_page(player: Player, upcoming_apps):
@@ -73,83 +172,47 @@ class Preview(Page):
             return 'end'
 
 
-class AttentionCheck1(Page):
-    pass
-
-
-class AttentionCheck1_2(Page):
-    form_model = 'player'
-    form_fields = ['attention_check']
-
-
-class AttentionCheck1_3(Page):
-
-    @staticmethod
-    def is_displayed(player):
-        return player.attention_check != player.attention_check_num
-
-
-class AttentionCheck2(Page):
-
-    @staticmethod
-    def is_displayed(player):
-        return player.attention_check != player.attention_check_num
-
-
-class AttentionCheck2_2(Page):
-    @staticmethod
-    def is_displayed(player):
-        return player.attention_check != player.attention_check_num
-
-    form_model = 'player'
-    form_fields = ['attention_check2']
-
+class AttentionCheck(Page):
+    """
+    记住数字 → 回忆，最多三次；三次都错则进入 end2。
+    整个过程在一个页面内通过 live_method 完成，只有最后提交一次表单。
+    """
 
-class AttentionCheck2_3(Page):
     @staticmethod
-    def is_displayed(player):
-        if player.field_maybe_none('attention_check2') is None:
-            return False  # Skip page if attention_check2 is None
-        return player.attention_check2 != player.attention_check_num2
+    def live_method(player: Player, data):
+        stage = player.attention_check_stage
+        kind = data.get('type')
+        if kind == 'remembered' and stage == REMEMBER:
+            player.attention_check_stage = RECALL
+        elif kind == 'answer' and stage == RECALL:
+            try:
+                answer = int(data['value'])
+            except (KeyError, TypeError, ValueError):
+                return {player.id_in_group: dict(attention_state(player), error='Please enter a number.')}
+            record_attention_answer(player, answer)
+        elif kind == 'retry' and stage == FEEDBACK:
+            player.attention_check_stage = REMEMBER
+        # 其他消息（页面加载、刷新、重复点击）只返回当前状态
+        return {player.id_in_group: attention_state(player)}
 
-
-class AttentionCheck3(Page):
-    @staticmethod
-    def is_displayed(player):
-        return (player.attention_check != player.attention_check_num
-                and player.attention_check2 is not None
-                and player.attention_check2 != player.attention_check_num2)
-
-
-class AttentionCheck3_2(Page):
-    @staticmethod
-    def is_displayed(player):
-        return player.field_maybe_none('attention_check2') not in [None, player.attention_check_num2]
-
-    form_model = 'player'
-    form_fields = ['attention_check3']
-
-
-class AttentionCheck3_3(Page):
     @staticmethod
-    def is_displayed(player):
-        return player.field_maybe_none('attention_check3') not in [None, player.attention_check_num3]
+    def error_message(player: Player, values):
+        if player.attention_check_stage not in (PASSED, FAILED):
+            return 'Please complete the attention check first.'
 
     @staticmethod
     def app_after_this_page(player, upcoming_apps):
-        if player.attention_check3 != player.attention_check_num3:
+        if player.attention_check_stage == FAILED:
             return 'end2'
 
 
 page_sequence = [
     Preview,
-    AttentionCheck1,
-    AttentionCheck1_2,
-    AttentionCheck1_3,
-    AttentionCheck2,
-    AttentionCheck2_2,
-    AttentionCheck2_3,
-    AttentionCheck3,
-    AttentionCheck3_2,
-    AttentionCheck3_3,
+    AttentionCheck,
 ]
+
+# 管理员报告：各页面人数和各页面方法的耗时
+track_pages(page_sequence, lambda player, name: increment_counter(player.subsession, name))
+instrument(__name__, page_sequence)
+# 启动时编译模板，第一个参与者不用等
+warm_up(__name__, page_sequence)
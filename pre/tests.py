@@ -0,0 +1,63 @@
+from otree.api import Currency as c, currency_range, expect, Bot, Submission
+from . import *
+
+# 所有 app 的 bot 共用这些 case，otree test 为每个 case 各建一个会话
+CASES = [
+    'pass_first',
+    'pass_second',
+    'pass_third',
+    'understanding_retry',
+    'fail_all',
+    'consent_declined',
+]
+# 通过注意力检查、进入 main 的 case
+REACHES_MAIN = ['pass_first', 'pass_second', 'pass_third', 'understanding_retry']
+
+
+# 每个 case 在第几次注意力检查时答对；None 表示三次都答错
+PASSES_ON_TRIAL = dict(pass_first=1, understanding_retry=1, pass_second=2, pass_third=3, fail_all=None)
+
+
+def call_live_method(method, group, case, **kwargs):
+    # 每组调用一次（pre 每组只有一人）
+    passes_on = PASSES_ON_TRIAL[case]
+    for p in group.get_players():
+        i = p.id_in_group
+        state = method(i, dict(type='answer', value=p.attention_check_num))[i]
+        # 还没确认记住数字，答案被忽略
+        expect(state['stage'], 'remember')
+        for trial, number in enumerate(attention_numbers(p), start=1):
+            state = method(i, dict(type='load'))[i]
+            expect(state, dict(stage='remember', trial=trial, number=number))
+            method(i, dict(type='remembered'))
+            expect(method(i, dict(type='answer', value='abc'))[i]['error'], 'Please enter a number.')
+            if trial == passes_on:
+                state = method(i, dict(type='answer', value=number))[i]
+                expect(state['stage'], 'passed')
+                break
+            state = method(i, dict(type='answer', value=number + 1))[i]
+            if trial < 3:
+                expect(state, dict(stage='feedback', trial=trial, correct=number, remaining=3 - trial))
+                method(i, dict(type='retry'))
+            else:
+                expect(state['stage'], 'failed')
+
+
+class PlayerBot(Bot):
+    cases = CASES
+
+    def play_round(self):
+        if self.case == 'consent_declined':
+            yield Preview, dict(consent=False)
+            return
+
+        yield Preview, dict(consent=True)
+        yield AttentionCheck
+
+        p = self.player
+        passes_on = PASSES_ON_TRIAL[self.case]
+        expect(p.attention_check_stage, 'failed' if passes_on is None else 'passed')
+        # 答错的次数加上答对的一次
+        expect(len(attention_answers(p)), passes_on or 3)
+        if passes_on:
+            expect(attention_answers(p)[-1], attention_numbers(p)[passes_on - 1])
@@ -14,6 +14,12 @@ SESSION_CONFIGS = [
 SESSION_CONFIG_DEFAULTS = dict(
     real_world_currency_per_point=1.00, 
     participation_fee=0.00, 
+    # 经理都在员工提交 Painting 时分配。'online'：按配对平衡在线抽取；'preallocate'：按创建会话时生成的分配方案依次领取
+    manager_allocation='online',
+    # 经理不足时是否重复使用经理（否则多出的参与者无法匹配）
+    manager_replacement=False,
+    # 预分配模式下使用的离线编译方案（python -m main.compile_plan），留空则现场生成
+    assignment_plan='',
     doc=""
 )
 
@@ -0,0 +1,175 @@
+"""
+Resized WebP/AVIF variants of the images in _static/img.
+
+    python static_images.py          # rebuild _static/img/build and its manifest
+
+The build writes each image at a few widths (never wider than the original),
+as AVIF and WebP, under content-hashed names, e.g.
+img/build/PaulKlee.320.3f9c0a1b2d.avif, and lists them in
+_static/img/build/manifest.json. A variant that is not smaller than the
+original file is dropped. The build needs Pillow (with AVIF support, as in
+the Pillow >= 11.3 wheels); the server does not, it only reads the manifest,
+so the build output is committed along with the images.
+
+picture(path, alt, sizes, ...) returns a <picture> element offering the
+variants of a _static path as srcsets, with the original as the <img>
+fallback, lazily loaded. It is Markup, so templates do not escape it. The hashed names never change content, so
+install_cache_headers() makes the static server send them with a one-year
+immutable Cache-Control; other static files keep the default revalidation.
+"""
+import hashlib
+import html
+import io
+import json
+import shutil
+import sys
+from pathlib import Path
+
+from markupsafe import Markup
+
+STATIC_DIR = Path(__file__).resolve().parent / '_static'
+SOURCE_DIR = 'img'
+BUILD_DIR = 'img/build'
+MANIFEST_PATH = STATIC_DIR / BUILD_DIR / 'manifest.json'
+SOURCE_SUFFIXES = ('.png', '.jpg', '.jpeg')
+
+# 输出宽度（px）；页面上的图片最大约 13rem 高，640 足够覆盖 2x 屏幕
+WIDTHS = (96, 160, 320, 640)
+# (MIME 类型, 后缀, Pillow 格式, 保存参数)，按浏览器优先选择的顺序
+FORMATS = (
+    ('image/avif', 'avif', 'AVIF', dict(quality=55)),
+    ('image/webp', 'webp', 'WEBP', dict(quality=80, method=6)),
+)
+HASH_LENGTH = 10
+
+CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+_manifest = None
+
+
+def _widths(original_width):
+    return sorted({min(width, original_width) for width in WIDTHS})
+
+
+def _encode(image, width, pil_format, options):
+    from PIL import Image
+
+    if width != image.width:
+        image = image.resize((width, round(image.height * width / image.width)), Image.LANCZOS)
+    buffer = io.BytesIO()
+    image.save(buffer, pil_format, **options)
+    return buffer.getvalue()
+
+
+def build_image(path):
+    """Write the variants of one image (a path relative to _static) and return its manifest entry."""
+    from PIL import Image
+
+    source = STATIC_DIR / path
+    with Image.open(source) as image:
+        image.load()
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'transparency' in image.info or image.mode in ('LA', 'PA') else 'RGB')
+    original_size = source.stat().st_size
+
+    sources = {}
+    for mime_type, suffix, pil_format, options in FORMATS:
+        variants = []
+        for width in _widths(image.width):
+            data = _encode(image, width, pil_format, options)
+            if len(data) >= original_size:
+                continue
+            digest = hashlib.sha256(data).hexdigest()[:HASH_LENGTH]
+            stem = Path(path).relative_to(SOURCE_DIR).with_suffix('').as_posix().replace('/', '-')
+            name = f'{BUILD_DIR}/{stem}.{width}.{digest}.{suffix}'
+            (STATIC_DIR / name).write_bytes(data)
+            variants.append([name, width])
+        if variants:
+            sources[mime_type] = variants
+    return dict(width=image.width, height=image.height, sources=sources)
+
+
+def build():
+    try:
+        from PIL import UnidentifiedImageError
+    except ImportError:
+        sys.exit('Building the images needs Pillow: pip install pillow')
+
+    # 先清空旧的输出，哈希变化后旧文件不会残留
+    shutil.rmtree(STATIC_DIR / BUILD_DIR, ignore_errors=True)
+    (STATIC_DIR / BUILD_DIR).mkdir(parents=True)
+
+    manifest = {}
+    for source in sorted((STATIC_DIR / SOURCE_DIR).rglob('*')):
+        if source.suffix.lower() not in SOURCE_SUFFIXES or (STATIC_DIR / BUILD_DIR) in source.parents:
+            continue
+        path = source.relative_to(STATIC_DIR).as_posix()
+        try:
+            manifest[path] = build_image(path)
+        except UnidentifiedImageError:
+            print(f'{path}: not a readable image, skipped')
+            continue
+        variants = [name for names in manifest[path]['sources'].values() for name, width in names]
+        print(f'{path}: {source.stat().st_size / 1024:.0f} KB, {len(variants)} variants')
+    MANIFEST_PATH.write_text(json.dumps(manifest, indent=2) + '\n')
+    print(f'Manifest written to {MANIFEST_PATH.relative_to(STATIC_DIR.parent)}')
+
+
+def manifest():
+    global _manifest
+    if _manifest is None:
+        _manifest = json.loads(MANIFEST_PATH.read_text()) if MANIFEST_PATH.exists() else {}
+    return _manifest
+
+
+def _attributes(attrs):
+    return ' '.join(f'{name}="{html.escape(str(value))}"' for name, value in attrs.items() if value is not None)
+
+
+def picture(path, alt='', sizes='100vw', loading='lazy', **attrs):
+    """
+    HTML for the image at `path` (relative to _static). `sizes` is the
+    rendered width, as in the sizes attribute; other keyword arguments become
+    attributes of the <img>, with class_ for class.
+    """
+    entry = manifest().get(path)
+    img = dict(src=f'/static/{path}', alt=alt, loading=loading, decoding='async')
+    if entry:
+        # 写明宽高，图片加载前就按比例占位，页面不会跳动
+        img.update(width=entry['width'], height=entry['height'])
+    img.update({name.rstrip('_'): value for name, value in attrs.items()})
+    tag = f'<img {_attributes(img)}>'
+    if not entry or not entry['sources']:
+        return Markup(tag)
+    sources = ''.join(
+        '<source {}>'.format(_attributes(dict(
+            type=mime_type,
+            srcset=', '.join(f'/static/{name} {width}w' for name, width in variants),
+            sizes=sizes,
+        )))
+        for mime_type, variants in entry['sources'].items()
+    )
+    return Markup(f'<picture>{sources}{tag}</picture>')
+
+
+def install_cache_headers():
+    """Serve the hashed build files with a long-lived Cache-Control header."""
+    from starlette.staticfiles import StaticFiles
+
+    file_response = StaticFiles.file_response
+    if getattr(file_response, 'caches_build_files', False):
+        return
+    build_dir = str(STATIC_DIR / BUILD_DIR)
+
+    def cached_file_response(self, full_path, stat_result, scope, status_code=200):
+        response = file_response(self, full_path, stat_result, scope, status_code)
+        if str(full_path).startswith(build_dir) and not str(full_path).endswith('.json'):
+            response.headers['cache-control'] = CACHE_CONTROL
+        return response
+
+    cached_file_response.caches_build_files = True
+    StaticFiles.file_response = cached_file_response
+
+
+if __name__ == '__main__':
+    build()
@@ -0,0 +1,71 @@
+"""
+Compiling an app's page templates when the server starts.
+
+oTree compiles a template the first time a page using it is shown, so
+without this the first participants after a deploy or restart wait for
+every template, the templates they extend and the components they include.
+warm_up(app_name, page_sequence, *loaders) is called at the end of an app's
+module, which oTree imports on startup: it loads each page's template into
+oTree's template cache, then every template it includes, and calls the
+loaders (e.g. reading the manager pool). The time taken is logged.
+
+Every command that sets up oTree imports the apps too (otree test,
+prodserver2of2, python -m main.settle, delta_export.py, benchmark.py, ...),
+so warm_up does nothing unless the process was started to serve pages
+(SERVER_COMMANDS).
+"""
+import sys
+import time
+
+from otree.templating import ibis_loader
+from otree.templating.nodes import BaseIncludeNode
+
+from experiment_log import get_logger
+
+logger = get_logger('warmup')
+
+# 提供页面的 otree 子命令（及其别名）；devserver 会在 devserver_inner 子进程中提供页面
+SERVER_COMMANDS = {
+    'devserver_inner', 'prodserver', 'prodserver1of2',
+    'runprodserver', 'runprodserver1of2', 'webandworkers',
+}
+
+
+def serving_pages():
+    """Whether this process was started by an otree command that serves pages."""
+    return len(sys.argv) > 1 and sys.argv[1] in SERVER_COMMANDS
+
+
+def _includes(node):
+    """The names of the templates included under `node` by a literal template name."""
+    names = []
+    if isinstance(node, BaseIncludeNode) and node.template_expr.is_literal:
+        names.append(node.expand_template_name(node.template_expr.literal))
+    for child in node.children:
+        names.extend(_includes(child))
+    return names
+
+
+def warm_up(app_name, page_sequence, *loaders):
+    if not serving_pages():
+        return
+    start = time.perf_counter()
+    loaded = set()
+    # 页面模板必须以页面类型编译（会自动继承 otree/Page.html），和 oTree 渲染时的缓存项一致
+    pending = [
+        (page.template_name or f'{app_name}/{page.__name__}.html', page._template_type)
+        for page in page_sequence
+    ]
+    while pending:
+        name, template_type = pending.pop()
+        if name in loaded:
+            continue
+        loaded.add(name)
+        template = ibis_loader.load(name, template_type=template_type)
+        pending.extend((included, None) for included in _includes(template.root_node))
+    for load in loaders:
+        load()
+    logger.info(
+        "Templates compiled",
+        extra=dict(app=app_name, templates=len(loaded), ms=round((time.perf_counter() - start) * 1000, 1)),
+    )